@@ -0,0 +1,104 @@
+import os
+import queue
+import threading
+from output_data import Outputdata, JOURNAL_SUFFIX
+
+
+class Autosaver:
+    '''
+    Save the labels of an Outputdata in the background.
+    request() takes the frames edited since the last request on the caller (GUI) thread, which only copies
+    those frames. A worker thread applies them to its own copy of the labels and saves it to path
+    with Outputdata.save, so the file is replaced atomically and most saves only append to its journal.
+    '''
+    def __init__(self, output, path, every_edits=20):
+        '''
+        output: the Outputdata edited by the GUI
+        path: autosave file, it holds every label whenever it has edits that were not saved by the user
+        every_edits: edited() requests a save after this many edits
+        '''
+        self.output = output
+        self.path = path
+        self.every_edits = every_edits
+        self.saves = 0
+        self.error = None
+        self._requested_seq = output.get_edit_seq()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def has_recovery(self):
+        '''
+        return True if the autosave file holds edits of a previous session that were never saved
+        '''
+        return os.path.isfile(self.path)
+    def recover(self):
+        '''
+        load the autosaved labels into the Outputdata
+        '''
+        self.output.load(self.path)
+        self.reset(clean=False)
+    def reset(self, clean=True):
+        '''
+        restart from the current labels of the Outputdata, after loading a file.
+        clean: the labels are saved by the user, the autosave file is removed until the next edit
+        '''
+        self._requested_seq = self.output.get_edit_seq()
+        self._queue.put(('reset', self.output.get_arrays(), clean))
+    def mark_saved(self):
+        '''
+        the user saved the labels, remove the autosave file until the next edit
+        '''
+        self.request()
+        self._queue.put(('clean', None, True))
+    def edited(self):
+        '''
+        call after each edit, requests a save every every_edits edits
+        '''
+        if self.output.get_edit_seq() - self._requested_seq >= self.every_edits:
+            self.request()
+    def request(self):
+        '''
+        queue a save of the edits made since the last request
+        '''
+        seq = self.output.get_edit_seq()
+        if seq == self._requested_seq:
+            return
+        edits = self.output.get_edits_since(self._requested_seq)
+        self._requested_seq = seq
+        self._queue.put(('edits', edits, False))
+    def stop(self, timeout=10):
+        '''
+        save the pending edits and wait for the worker to finish
+        '''
+        self.request()
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+    def _remove_files(self):
+        for path in (self.path, self.path + JOURNAL_SUFFIX):
+            if os.path.isfile(path):
+                os.remove(path)
+    def _run(self):
+        mirror = Outputdata()
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            kind, data, clean = task
+            try:
+                if kind == 'reset':
+                    mirror.set_arrays(data)
+                    if clean:
+                        self._remove_files()
+                    else:
+                        mirror.save(self.path, compact=False)
+                elif kind == 'clean':
+                    self._remove_files()
+                elif len(data) > 0:
+                    mirror.apply_edits(data)
+                    mirror.save(self.path, compact=False)
+                    self.saves += 1
+                self.error = None
+            except OSError as e:
+                #keep the edits in the mirror, the next save writes them again
+                self.error = e
+                print(f"Autosave failed: {e}")
@@ -0,0 +1,91 @@
+import os
+import time
+import argparse
+import numpy as np
+import dataset as ds
+import data_handler as dh
+import consensus as cs
+import gap_fill as gf
+from output_data import Outputdata, LABEL_DIMS
+
+#one output per video: <output folder>/<video>.glmks, loadable in the editor
+OUTPUT_SUFFIX = '.glmks'
+
+
+def output_path(output_dir, video):
+    return os.path.join(output_dir, video + OUTPUT_SUFFIX)
+
+def consensus_labels(handler, methods, mode='mean', trim=0.25, fill=None, max_gap=None):
+    '''
+    return the labeled frames and their (n, 75, 3) ground truth points of the current video of a DataHandler:
+    the consensus of methods on every frame where at least one of them detected a joint.
+    fill: None, or the gap_fill interpolation used to fill the joints no method detected (up to max_gap frames)
+    '''
+    points = cs.get_video_consensus(handler, methods, mode, trim)
+    points = np.asarray(points[:handler.get_total_frames(), :, :LABEL_DIMS], dtype=np.float64)
+    if fill is not None:
+        points, _ = gf.fill_gaps(points, interpolation=fill, max_gap=max_gap)
+    frames = np.flatnonzero(points.any(axis=(1, 2)))
+    return frames, points[frames]
+
+def label_video(data_path, video, output_dir, methods=None, mode='mean', trim=0.25, fill=None, max_gap=None, force=False):
+    '''
+    write the consensus labels of one video to output_dir, return the number of labeled frames,
+    or None if the output already exists (the output is written atomically, so an existing one is complete)
+    '''
+    path = output_path(output_dir, video)
+    if not force and os.path.isfile(path):
+        return None
+    handler = dh.DataHandler(data_path, use_keyframe_index=False, use_proxies=False)
+    handler.set_video(video)
+    available = handler.get_current_method_list()
+    methods = available if methods is None else [method for method in methods if method in available]
+    if len(methods) == 0:
+        raise Exception('none of the methods is available for this video')
+    frames, points = consensus_labels(handler, methods, mode, trim, fill, max_gap)
+    output = Outputdata()
+    output.set_arrays({video: (frames, points)})
+    output.save(path)
+    return len(frames)
+
+def combine_outputs(output_dir, videos, path):
+    '''
+    merge the per video outputs into one file, return the number of videos found
+    '''
+    combined = Outputdata()
+    videos_found = {}
+    for video in videos:
+        if not os.path.isfile(output_path(output_dir, video)):
+            continue
+        output = Outputdata()
+        output.load(output_path(output_dir, video))
+        videos_found.update(output.get_arrays())
+    combined.set_arrays(videos_found)
+    combined.save(path)
+    return len(videos_found)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Label every video in metadata.json with the consensus of its methods, without the GUI')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('output_dir', help='folder of the <video>.glmks outputs')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of videos labeled in parallel')
+    parser.add_argument('-m', '--methods', nargs='+', default=None, help='methods to combine (default: every method of each video)')
+    parser.add_argument('--mode', choices=cs.MODES, default='mean', help='how the methods are combined')
+    parser.add_argument('--trim', type=float, default=0.25, help='fraction trimmed on each side in trimmed mode')
+    parser.add_argument('--fill', choices=gf.INTERPOLATIONS, default=None, help='fill the joints no method detected by interpolating over time')
+    parser.add_argument('--max-gap', type=int, default=None, help='longest gap in frames that --fill fills (default: no limit)')
+    parser.add_argument('--videos', nargs='+', default=None, help='videos to label (default: all)')
+    parser.add_argument('--force', action='store_true', help='label videos that already have an output')
+    parser.add_argument('--combine', default=None, help='also merge every output into this .glmks file')
+    args = parser.parse_args()
+
+    metadata = ds.load_metadata(args.data_path)
+    videos = ds.select_videos(metadata, args.videos)
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.time()
+    tasks = {video: (args.data_path, video, args.output_dir, args.methods, args.mode, args.trim, args.fill, args.max_gap, args.force) for video in videos}
+    status = lambda frames: f"{'already labeled' if frames is None else f'{frames} frames labeled'} ({time.time() - start:.1f}s)"
+    ds.run_tasks(label_video, tasks, status, args.jobs)
+    if args.combine is not None:
+        print(f'Combined {combine_outputs(args.output_dir, videos, args.combine)} videos into {args.combine}')
@@ -0,0 +1,89 @@
+import json
+import hashlib
+import warnings
+import numpy as np
+import skeleton_store as ss
+
+#how the skeletons of several methods are combined into one
+MODES = ['mean', 'weighted', 'median', 'trimmed']
+MODE_NAMES = {'mean': 'Mean', 'weighted': 'Weighted mean', 'median': 'Median', 'trimmed': 'Trimmed mean'}
+
+
+def valid_mask(points):
+    '''
+    return the mask of detected values, a zero coordinate means the method did not detect the joint
+    '''
+    return points != 0
+
+def consensus(points, valid=None, weights=None, mode='mean', trim=0.25):
+    '''
+    combine the skeletons of several methods in one vectorized pass.
+    points: (..., methods, joints, dims), any leading axes (e.g. frames) are kept
+    valid: mask broadcastable to points, values outside it are ignored. Default: non zero values
+    weights: (..., methods, joints) weights of the 'weighted' mode, e.g. visibility/hand scores
+    mode: one of MODES
+    trim: fraction of the lowest and highest values dropped on each side in 'trimmed' mode
+    return (..., joints, dims), zero where no method has a valid value
+    '''
+    points = np.asarray(points, dtype=np.float32)
+    valid = valid_mask(points) if valid is None else np.broadcast_to(valid, points.shape)
+    if mode in ('mean', 'weighted'):
+        w = valid.astype(np.float32)
+        if mode == 'weighted' and weights is not None:
+            w = w * np.asarray(weights, dtype=np.float32)[..., None]
+        total = (points * w).sum(axis=-3)
+        count = w.sum(axis=-3)
+        return np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    if mode == 'median':
+        masked = np.where(valid, points, np.nan)
+        with warnings.catch_warnings():
+            #all-NaN slices are joints no method detected
+            warnings.simplefilter('ignore', RuntimeWarning)
+            result = np.nanmedian(masked, axis=-3)
+        return np.nan_to_num(result, nan=0.0).astype(np.float32)
+    if mode == 'trimmed':
+        assert 0 <= trim < 0.5, 'trim must be in [0, 0.5)'
+        #NaN sorts last, so the valid values of each slot come first in order
+        ordered = np.sort(np.where(valid, points, np.nan), axis=-3)
+        count = valid.sum(axis=-3, keepdims=True)
+        cut = np.floor(count * trim).astype(count.dtype)
+        rank = np.arange(points.shape[-3]).reshape((-1, 1, 1))
+        keep = (rank >= cut) & (rank < count - cut)
+        total = np.where(keep, ordered, 0).sum(axis=-3)
+        kept = keep.sum(axis=-3)
+        return np.divide(total, kept, out=np.zeros_like(total), where=kept > 0)
+    raise ValueError(f'Unknown consensus mode: {mode}')
+
+def video_consensus_key(handler, methods, mode='mean', trim=0.25):
+    '''
+    return the cache key of a whole video consensus: the video, the method set, the method files and the mode
+    '''
+    key = {'video': handler.get_current_video(),
+           'methods': {method: handler.get_method_stamp(method) for method in sorted(methods)},
+           'mode': mode, 'trim': trim if mode == 'trimmed' else None}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def compute_video_consensus(handler, methods, mode='mean', trim=0.25, chunk_frames=8192):
+    '''
+    compute the consensus skeleton of every frame of the current video of a DataHandler, as (frames, 75, 4).
+    Frames past the end of the shortest method file are left out
+    '''
+    frames = min(handler.get_method_frame_count(method) for method in methods)
+    result = np.zeros((frames, ss.JOINTS, ss.JOINT_DIMS), dtype=np.float32)
+    #chunks only bound the memory of the stacked (frames, methods, joints, dims) tensor
+    for start in range(0, frames, chunk_frames):
+        chunk = slice(start, min(start + chunk_frames, frames))
+        joints = [handler.get_joints(method, chunk) for method in methods]
+        points = np.stack([points for points, _ in joints], axis=1)
+        scores = np.stack([scores for _, scores in joints], axis=1)
+        result[chunk] = consensus(points, weights=scores, mode=mode, trim=trim)
+    return result
+
+def get_video_consensus(handler, methods, mode='mean', trim=0.25):
+    '''
+    return the whole video consensus of methods, from the cache folder if it was computed before.
+    The cache is keyed on the method set, method files and mode, so it is recomputed when any of them change
+    '''
+    group = f'{handler.get_current_video()}-'
+    name = f'{group}{video_consensus_key(handler, methods, mode, trim)}.npy'
+    return handler.get_cached_array('consensus', name, lambda: compute_video_consensus(handler, methods, mode, trim), group)
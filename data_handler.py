@@ -4,18 +4,60 @@ import json
 import cv2
 import datetime as dt
 import time
-import pickle as pkl
+from collections import OrderedDict
+from frame_provider import FrameProvider, FramePrefetcher
+import keyframe_index as kfi
+import proxy_cache as pc
+import frame_store as fs
+from session_pool import VideoSession, SessionPool
+import skeleton_store as ss
+import dataset as ds
 #from PyQt5.QtGui import *
 
+#cached arrays kept per group (e.g. per video) and kind, the least recently used other keys are deleted
+CACHE_KEEP = 4
+
 class DataHandler:
     '''
     A class to handle the data
     '''
-    def __init__(self, data_path):
+    def __init__(self, data_path, cache_frames=120, cache_mb=512, use_keyframe_index=True, convert_method_files=True, skeleton_cache_mb=1024, cache_dir=None, use_frame_store=True, use_proxies=True, build_proxies=False, proxy_height=pc.PROXY_HEIGHT, session_videos=4, session_mb=1024):
         '''
         data_path: path to the data folder
+        cache_frames, cache_mb: bounds of the decoded frame cache of the current video
+        use_keyframe_index: build or load the keyframe index of each video for fast random access (needs PyAV)
+        convert_method_files: write a memory mappable copy of .json/.lmks method files the first time they are loaded
+        skeleton_cache_mb: memory budget of the loaded methods, inactive methods are evicted beyond it
+        cache_dir: folder of the derived data caches (consensus, ...), default: .hple_cache in the data folder
+        use_frame_store: read the frames from the frame store of the video when it was exported (see frame_store.py)
+        use_proxies: serve get_proxy_frame from the low resolution all intra proxy of the video when there is one (see proxy_cache.py)
+        build_proxies: build the missing proxy of each video opened in the background, for the editor only:
+                       a short lived process would leave the transcode unfinished
+        proxy_height: maximum height of the proxies
+        session_videos, session_mb: bounds of the pool of recently used videos kept open besides the current one (see session_pool.py)
         '''
         self.data_path = data_path
+        self.cache_dir = ds.get_cache_dir(data_path, cache_dir)
+        self.cache_frames = cache_frames
+        self.cache_mb = cache_mb
+        self.use_keyframe_index = use_keyframe_index
+        self.convert_method_files = convert_method_files
+        self.skeleton_cache_bytes = int(skeleton_cache_mb * 1024 * 1024)
+        self.skeleton_data = OrderedDict()
+        self._active_methods = set()
+        self._prefetcher = None
+        self._proxy_buffer = None
+        self.use_frame_store = use_frame_store
+        self.use_proxies = use_proxies
+        self.build_proxies = build_proxies
+        self.proxy_height = proxy_height
+        self._proxy_builder = None
+        self._proxy_path = None
+        self._proxy_provider = None
+        self._proxy_frames = 0
+        #whether the prefetcher decodes the proxy instead of the video
+        self._prefetch_proxy = False
+        self._sessions = SessionPool(session_videos, session_mb)
         self.current_video = None
         self.current_video_data = None
         self.current_frame = 0
@@ -42,29 +84,30 @@ class DataHandler:
         return self.methods
     def set_video(self, video_name):
         '''
-        set the current video
+        set the current video. A recently used video is taken back from the session pool as it was left,
+        at the same frame, without reopening anything
         '''
-        #if _current_video is not None, release it
-        if hasattr(self, '_current_video'):
-            self._current_video.release()
+        self.stop_prefetch()
         assert video_name in self.metadata, 'Video name not in the metadata'
         assert os.path.isfile(os.path.join(self.data_path, self.metadata[video_name]['local_path'])), 'Video file not found'
+        #taken before the previous video is kept, which may push the least recently used one out of the pool
+        session = self._get_session() if video_name == self.current_video else self._sessions.take(video_name)
+        #the previous video is kept open in the pool instead of being released
+        if self.current_video is not None and video_name != self.current_video:
+            self._sessions.put(self._get_session())
+        self._proxy_provider = None
+        self._proxy_path = None
 
         self.current_video = video_name
         self.current_video_data = self.metadata[video_name]
+        if session is not None:
+            self._set_session(session)
+            return self.current_video, self.current_video_data
 
         assert len(self.get_current_method_list()) == len([a for a in self.metadata[video_name]['methods'] if os.path.isfile(os.path.join(self.data_path, self.metadata[video_name]['methods'][a]))]), 'Some method files not found'
 
-        self.skeleton_data = {}
-
-        #TODO: load in UI, create a set_skeleton_data method for later use (or could change to pickle file)
-        for method in self.get_current_method_list():
-            if '.json' in self.metadata[video_name]['methods'][method]:
-                with open(os.path.join(self.data_path, self.metadata[video_name]['methods'][method]), 'r',encoding='utf-8') as f:
-                    self.skeleton_data[method] = json.load(f)
-            elif '.lmks' in self.metadata[video_name]['methods'][method]:
-                with open(os.path.join(self.data_path, self.metadata[video_name]['methods'][method]), 'rb') as f:
-                    self.skeleton_data[method] = pkl.load(f)
+        #methods are loaded on first access, see _get_skeleton_data
+        self.skeleton_data = OrderedDict()
 
         self.current_frame = 0
         #set the total frame by reading the video using cv2
@@ -74,8 +117,44 @@ class DataHandler:
         self._width = int(self._current_video.get(cv2.CAP_PROP_FRAME_WIDTH))
         self._height = int(self._current_video.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self._fps = self._current_video.get(cv2.CAP_PROP_FPS)
+        #an exported frame store, when it covers the whole video, replaces the decoder
+        store = fs.open_store(fs.store_path(self.cache_dir, video_path)) if self.use_frame_store else None
+        if store is not None and len(store) >= self.total_frame:
+            self._current_video.release()
+            self._keyframe_index = None
+            self._frame_provider = fs.FrameStoreProvider(store, self.cache_frames, self.cache_mb)
+        else:
+            #keyframe positions let random access seek straight to the GOP of the frame
+            self._keyframe_index = kfi.load_index(video_path) if self.use_keyframe_index else None
+            self._frame_provider = FrameProvider(self._current_video, self.cache_frames, self.cache_mb, keyframe_index=self._keyframe_index)
+        if self.use_proxies:
+            self._proxy_path = pc.proxy_path(self.cache_dir, video_path, self.proxy_height)
+            if not self._open_proxy() and self.build_proxies:
+                if self._proxy_builder is None:
+                    self._proxy_builder = pc.ProxyBuilder(self.proxy_height)
+                self._proxy_builder.request(video_path, self._proxy_path)
         
         return self.current_video, self.current_video_data
+    def _get_session(self):
+        return VideoSession(self.current_video, self._frame_provider, self._keyframe_index, self.total_frame, self._width, self._height, self._fps,
+                            self.skeleton_data, self._proxy_path, self._proxy_provider, self._proxy_frames, self.current_frame)
+    def _set_session(self, session):
+        self._frame_provider = session.frame_provider
+        self._keyframe_index = session.keyframe_index
+        self.total_frame = session.total_frame
+        self._width = session.width
+        self._height = session.height
+        self._fps = session.fps
+        self.skeleton_data = session.skeleton_data
+        self._proxy_path = session.proxy_path
+        self._proxy_provider = session.proxy_provider
+        self._proxy_frames = session.proxy_frames
+        self.current_frame = session.current_frame
+    def get_session_stats(self):
+        '''
+        return the number of videos kept open besides the current one, the memory they hold in MB and the pool hits/misses
+        '''
+        return {'videos': len(self._sessions), 'mb': self._sessions.nbytes() / 1024 / 1024, 'hits': self._sessions.hits, 'misses': self._sessions.misses}
     def get_current_video(self):
         '''
         return the current video name
@@ -125,11 +204,97 @@ class DataHandler:
         '''
         assert self.current_video_data is not None, 'No current video is set'
         assert self.current_frame < self.total_frame, 'Frame number out of range'
-        self._current_video.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
-        success, image = self._current_video.read()
-        if not success:
-            raise Exception('Error reading frame')
-        return image
+        #frames are shared with the frame cache, copy before modifying them
+        if self._prefetcher is not None and not self._prefetch_proxy:
+            image = self._prefetcher.get(self.current_frame)
+            if image is not None:
+                self._frame_provider.adopt(self.current_frame, image)
+                return image
+        return self._frame_provider.get(self.current_frame)
+    def release_frame(self, image):
+        '''
+        hand back a frame of the current frame number returned by get_frame or get_proxy_frame, once it is no longer used:
+        its memory can then be reused to decode later frames
+        '''
+        self._frame_provider.release_frame(self.current_frame, image)
+        if self._proxy_provider is not None:
+            self._proxy_provider.release_frame(self.current_frame, image)
+    def get_proxy_frame(self, scale):
+        '''
+        return the current frame downscaled by scale (< 1), a lighter frame to display during playback and scrubbing.
+        It comes from the proxy of the video when there is one, and is then at most the proxy size, whatever the scale.
+        The frame is written into a buffer reused by the next call, copy it to keep it
+        '''
+        assert self.current_video_data is not None, 'No current video is set'
+        size = (max(1, round(self._width * scale)), max(1, round(self._height * scale)))
+        image = self._get_proxy_video_frame()
+        if image is None:
+            image = self.get_frame()
+        elif image.shape[1] <= size[0]:
+            return image
+        if self._proxy_buffer is None or self._proxy_buffer.shape[1::-1] != size:
+            self._proxy_buffer = np.empty((size[1], size[0], image.shape[2]), dtype=image.dtype)
+        #linear is several times faster than area averaging at 4K, some aliasing is fine for a moving picture
+        proxy = cv2.resize(image, size, dst=self._proxy_buffer, interpolation=cv2.INTER_LINEAR)
+        self.release_frame(image)
+        return proxy
+    def has_proxy(self):
+        '''
+        return True if the current video has a proxy, opening it if it was built since the video was set
+        '''
+        if self._proxy_provider is None and self._proxy_builder is not None and self._proxy_builder.is_built(self._proxy_path):
+            self._open_proxy()
+        return self._proxy_provider is not None
+    def _open_proxy(self):
+        capture = pc.open_proxy(self._proxy_path)
+        if capture is None:
+            return False
+        #frames past the end of the proxy, if it is shorter than the reported frame count, come from the video
+        self._proxy_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._proxy_provider = FrameProvider(capture, self.cache_frames, None if self.cache_mb is None else self.cache_mb / 4)
+        return True
+    def _get_proxy_video_frame(self):
+        if not self.has_proxy() or self.current_frame >= self._proxy_frames:
+            return None
+        if self._prefetcher is not None and self._prefetch_proxy:
+            image = self._prefetcher.get(self.current_frame)
+            if image is not None:
+                self._proxy_provider.adopt(self.current_frame, image)
+                return image
+        return self._proxy_provider.get(self.current_frame)
+    def start_prefetch(self, direction=1, queue_size=16, proxy=False):
+        '''
+        start decoding frames after the current frame in the background, used during playback.
+        proxy: decode the proxy of the video instead, when there is one, for playback with get_proxy_frame.
+        Otherwise the frames are read from the frame store of the video when it has one
+        '''
+        assert self.current_video_data is not None, 'No current video is set'
+        self.stop_prefetch()
+        video_path = os.path.join(self.data_path, self.current_video_data['local_path'])
+        store = self._frame_provider.store if isinstance(self._frame_provider, fs.FrameStoreProvider) else None
+        self._prefetch_proxy = proxy and self.has_proxy()
+        if self._prefetch_proxy:
+            video_path = self._proxy_path
+            store = None
+        self._prefetcher = FramePrefetcher(video_path, self.current_frame + direction, self.total_frame, direction, queue_size, store)
+    def stop_prefetch(self):
+        '''
+        stop the background decoding, return the delivered/dropped/late frame counts or None if it was not running
+        '''
+        if self._prefetcher is None:
+            return None
+        self._prefetcher.stop()
+        stats = self._prefetcher.get_stats()
+        self._prefetcher = None
+        self._prefetch_proxy = False
+        return stats
+    def stop_proxy_builder(self):
+        '''
+        stop building proxies in the background, the proxy being built is discarded
+        '''
+        if self._proxy_builder is not None:
+            self._proxy_builder.stop()
+            self._proxy_builder = None
     def get_current_duration(self):
         '''
         return the duration of the current video, format: HH:MM:SS, rounded to the nearest .01
@@ -142,6 +307,12 @@ class DataHandler:
             return _s[0]+'.'+_s[1][:2]
         else:
             return s
+    def get_fps(self):
+        '''
+        return the frame rate of the current video
+        '''
+        assert self.current_video_data is not None, 'No current video is set'
+        return self._fps
     def get_video_dimension(self):
         '''
         return the dimension of the current video
@@ -152,42 +323,113 @@ class DataHandler:
         '''
         return the skeleton data for the current frame and the current method
         '''
+        return self.get_skeleton(method, self.current_frame, as_pixels)
+    def get_skeleton(self, method, frame, as_pixels=False):
+        '''
+        return pose, hand as read only views of the method arrays, coordinates are normalized (as_pixels is kept for compatibility)
+        '''
         assert self.current_video_data is not None, 'No current video is set'
         assert method in self.get_current_method_list(), 'Method not found'
-        pose = self.skeleton_data[method]['pose'][self.current_frame].copy()
-        hand = self.skeleton_data[method]['hands'][self.current_frame].copy()
-
-        if as_pixels:
-            for point in pose:
-                #pose is a list of x,y,z,visibility, multiply by width and height to get the pixel value
-                point[0] = point[0]
-                point[1] = point[1]
-            for hand_ in hand:
-                for point in hand[hand_]['landmarks']:
-                    #hand is a dict, landmarks is a list of x,y,z, multiply by width and height to get the pixel value
-                    point[0] = point[0]
-                    point[1] = point[1]
-        return pose, hand
-    def get_skeleton(self, method, frame, as_pixels=False):
+        return self._get_skeleton_data(method).get_frame(frame)
+    def get_joints(self, method, frames):
         '''
-        return pose, hand
+        return the whole skeleton of a frame (or frames, as a slice or array) as points (..., 75, 4) and joint scores (..., 75)
         '''
         assert self.current_video_data is not None, 'No current video is set'
         assert method in self.get_current_method_list(), 'Method not found'
-        pose = self.skeleton_data[method]['pose'][frame].copy()
-        hand = self.skeleton_data[method]['hands'][frame].copy()
-
-        if as_pixels:
-            for point in pose:
-                #pose is a list of x,y,z,visibility, multiply by width and height to get the pixel value
-                point[0] = point[0]
-                point[1] = point[1]
-            for hand_ in hand:
-                for point in hand[hand_]['landmarks']:
-                    #hand is a dict, landmarks is a list of x,y,z, multiply by width and height to get the pixel value
-                    point[0] = point[0]
-                    point[1] = point[1]
-        return pose, hand
+        return self._get_skeleton_data(method).get_joints(frames)
+    def get_method_frame_count(self, method):
+        '''
+        return the number of frames in the method file, which may differ from the video frame count
+        '''
+        return len(self._get_skeleton_data(method))
+    def get_method_stamp(self, method):
+        '''
+        return [file, size, mtime] of the method file, derived data is keyed on it to notice changed files
+        '''
+        path = os.path.join(self.data_path, self.current_video_data['methods'][method])
+        return [self.current_video_data['methods'][method]] + ds.source_stamp(path)
+    def get_cache_path(self, kind, name):
+        '''
+        return the path of a file in the cache folder of a kind of derived data, creating the folder
+        '''
+        folder = os.path.join(self.cache_dir, kind)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
+    def get_cached_array(self, kind, name, compute, group=None):
+        '''
+        return the array cached as name in the cache folder of kind, memory mapped,
+        or compute() it and cache it. Without a writable cache folder the array is computed every time.
+        group: prefix of the names '<group><sha1 key>.npy' that supersede each other (e.g. '<video>-'),
+               only the CACHE_KEEP most recently used of them are kept
+        '''
+        try:
+            path = self.get_cache_path(kind, name)
+        except OSError:
+            return compute()
+        if os.path.isfile(path):
+            try:
+                result = np.load(path, mmap_mode='r')
+                #the modification time orders the group by last use
+                os.utime(path)
+                return result
+            except (OSError, ValueError):
+                pass
+        result = compute()
+        #write then rename, an interrupted write never leaves a truncated cache behind
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, result)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+        if group is not None:
+            self._prune_cache(os.path.dirname(path), group)
+        return result
+    def _prune_cache(self, folder, group):
+        #only '<group><40 hex digits>.npy' names, '<video>-<method>-<key>.npy' is not in the group '<video>-'
+        paths = []
+        for file in os.listdir(folder):
+            key = file[len(group):-len('.npy')]
+            if file.startswith(group) and file.endswith('.npy') and len(key) == 40 and all(c in '0123456789abcdef' for c in key):
+                paths.append(os.path.join(folder, file))
+        for path in sorted(paths, key=self._mtime, reverse=True)[CACHE_KEEP:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+    def set_active_methods(self, methods):
+        '''
+        set the methods in use (checked in the UI), the other loaded methods may be evicted under memory pressure
+        '''
+        self._active_methods = set(methods)
+        self._evict_skeleton_data()
+    def _get_skeleton_data(self, method):
+        #each method is kept as contiguous arrays, see skeleton_store.SkeletonArrays
+        #converted methods are memory mapped, only the frames that are accessed are read from disk
+        if method in self.skeleton_data:
+            self.skeleton_data.move_to_end(method)
+            return self.skeleton_data[method]
+        path = os.path.join(self.data_path, self.current_video_data['methods'][method])
+        self.skeleton_data[method] = ss.load_method_file(path, self.convert_method_files)
+        self._evict_skeleton_data(keep=method)
+        return self.skeleton_data[method]
+    def _evict_skeleton_data(self, keep=None):
+        #mapped methods are paged by the OS, only methods held in memory count against the budget
+        loaded = {method: data.nbytes() for method, data in self.skeleton_data.items() if not data.is_mapped()}
+        total = sum(loaded.values())
+        for method in list(self.skeleton_data):
+            if total <= self.skeleton_cache_bytes:
+                break
+            if method in loaded and method != keep and method not in self._active_methods:
+                total -= loaded[method]
+                del self.skeleton_data[method]
     def pixel_skeleton_to_normalized(self, pose, hand):
         '''
         convert the pixel skeleton to normalized
@@ -0,0 +1,58 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#folder of the derived data caches (consensus, metrics, proxies, ...), in the data folder
+DEFAULT_CACHE_DIR = '.hple_cache'
+
+
+def get_cache_dir(data_path, cache_dir=None):
+    return cache_dir if cache_dir is not None else os.path.join(data_path, DEFAULT_CACHE_DIR)
+
+def source_stamp(path):
+    '''
+    return [size, mtime in ns] of a source file, the derived data of a file is stale when its stamp changed
+    '''
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def source_key(path, *settings):
+    '''
+    return the sha1 key of the derived data of a source file made with settings, a changed source gets a new key
+    '''
+    key = [os.path.basename(path)] + source_stamp(path) + list(settings)
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+def load_metadata(data_path):
+    with open(os.path.join(data_path, 'metadata.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def select_videos(metadata, videos=None):
+    '''
+    return the videos of metadata to process: all of them, or those of videos that are in metadata
+    '''
+    return list(metadata) if videos is None else [video for video in videos if video in metadata]
+
+def run_tasks(function, tasks, status=str, jobs=None):
+    '''
+    run function(*args) for every name: args of tasks, printing "[i/n] name: status(result)" as each one finishes.
+    jobs: number of processes, None to run the tasks one after the other in this process
+    return {name: result} of the tasks that did not fail
+    '''
+    results = {}
+    def report(i, name, run):
+        try:
+            results[name] = run()
+            print(f'[{i+1}/{len(tasks)}] {name}: {status(results[name])}')
+        except Exception as e:
+            print(f'[{i+1}/{len(tasks)}] {name}: failed ({e})')
+    if jobs is None:
+        for i, name in enumerate(tasks):
+            report(i, name, lambda: function(*tasks[name]))
+        return results
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(function, *tasks[name]): name for name in tasks}
+        for i, future in enumerate(as_completed(futures)):
+            report(i, futures[future], future.result)
+    return results
@@ -0,0 +1,346 @@
+import queue
+import threading
+from collections import OrderedDict
+import cv2
+
+
+class FrameCache:
+    '''
+    A bounded LRU cache of decoded frames, limited by frame count and/or size in MB
+    '''
+    def __init__(self, max_frames=120, max_mb=None):
+        '''
+        max_frames: maximum number of frames kept in memory (None for no limit)
+        max_mb: maximum total size of the kept frames in MB (None for no limit)
+        '''
+        self.max_frames = max_frames
+        self.max_bytes = None if max_mb is None else int(max_mb * 1024 * 1024)
+        self._frames = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        #optional function called with the frame number and image of every evicted frame
+        self.on_evict = None
+    def __len__(self):
+        return len(self._frames)
+    def __contains__(self, frame_number):
+        return frame_number in self._frames
+    def nbytes(self):
+        '''
+        return the total size of the cached frames in bytes
+        '''
+        return self._bytes
+    def get(self, frame_number):
+        '''
+        return the cached frame or None, and mark it as most recently used
+        '''
+        image = self._frames.get(frame_number)
+        if image is None:
+            self.misses += 1
+            return None
+        self._frames.move_to_end(frame_number)
+        self.hits += 1
+        return image
+    def put(self, frame_number, image):
+        '''
+        add a frame to the cache, evicting the least recently used frames if needed
+        '''
+        if frame_number in self._frames:
+            self._bytes -= self._frames.pop(frame_number).nbytes
+        self._frames[frame_number] = image
+        self._bytes += image.nbytes
+        while len(self._frames) > 1 and self._over_budget():
+            evicted_number, evicted = self._frames.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            if self.on_evict is not None:
+                self.on_evict(evicted_number, evicted)
+    def clear(self):
+        self._frames.clear()
+        self._bytes = 0
+    def _over_budget(self):
+        if self.max_frames is not None and len(self._frames) > self.max_frames:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+
+class FrameBufferPool:
+    '''
+    Frames evicted from a FrameCache, recycled as decode targets so that steady playback decodes
+    into existing memory instead of allocating a new frame every time.
+    Only frames nobody holds anymore may be put in, see FrameProvider.release_frame
+    '''
+    def __init__(self, max_buffers=4):
+        self.max_buffers = max_buffers
+        self._buffers = []
+    def __len__(self):
+        return len(self._buffers)
+    def nbytes(self):
+        return sum(image.nbytes for image in self._buffers)
+    def put(self, image):
+        if len(self._buffers) < self.max_buffers and image.flags.owndata:
+            self._buffers.append(image)
+    def get(self, shape):
+        '''
+        return a writeable buffer of the given shape or None
+        '''
+        while len(self._buffers) > 0:
+            image = self._buffers.pop()
+            if image.shape == shape:
+                image.flags.writeable = True
+                return image
+        return None
+    def clear(self):
+        self._buffers.clear()
+
+
+class FrameProvider:
+    '''
+    Serve frames of a cv2.VideoCapture by frame number.
+    Forward access close to the decoder position is served by reading on instead of seeking,
+    so playback and stepping never pay a keyframe seek. Decoded frames are kept in a FrameCache.
+    '''
+    def __init__(self, capture, cache_frames=120, cache_mb=None, read_ahead=32, keyframe_index=None):
+        '''
+        capture: an opened cv2.VideoCapture, owned by the provider from now on
+        cache_frames, cache_mb: bounds of the decoded frame cache
+        read_ahead: frames up to this distance ahead of the decoder position are reached
+                    by decoding forward instead of seeking
+        keyframe_index: optional KeyframeIndex of the video, random access then seeks straight
+                        to the keyframe of the GOP and decodes at most one GOP
+        '''
+        self._capture = capture
+        self.cache = FrameCache(cache_frames, cache_mb)
+        self.pool = FrameBufferPool()
+        self.cache.on_evict = self._evicted
+        #frame number -> [image, count] of the frames returned by get and not released yet
+        self._borrowed = {}
+        #shape of the last decoded frame, the shape of the recycled buffers
+        self._shape = None
+        self.read_ahead = read_ahead
+        self.keyframe_index = keyframe_index
+        #frame number that the next read() of the capture returns, -1 if unknown
+        self._next_frame = 0
+        self.seeks = 0
+    def get(self, frame_number):
+        '''
+        return the BGR image of the frame, the returned array is shared with the cache and read only
+        '''
+        image = self.cache.get(frame_number)
+        if image is None:
+            image = self._decode(frame_number)
+        self._borrow(frame_number, image)
+        return image
+    def adopt(self, frame_number, image):
+        '''
+        add a frame decoded elsewhere (e.g. by a FramePrefetcher) to the cache, as returned to the caller
+        '''
+        self.cache.put(frame_number, image)
+        self._borrow(frame_number, image)
+    def release_frame(self, frame_number, image):
+        '''
+        hand back a frame returned by get once the caller holds no reference to it anymore, so its memory
+        can be recycled when it leaves the cache. Frames never handed back are simply never recycled
+        '''
+        entry = self._borrowed.get(frame_number)
+        if entry is not None and entry[0] is image:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._borrowed[frame_number]
+    def _borrow(self, frame_number, image):
+        entry = self._borrowed.get(frame_number)
+        if entry is None or entry[0] is not image:
+            self._borrowed[frame_number] = [image, 1]
+        else:
+            entry[1] += 1
+    def _evicted(self, frame_number, image):
+        entry = self._borrowed.get(frame_number)
+        if entry is not None and entry[0] is image:
+            #still held by a caller, it is never recycled
+            del self._borrowed[frame_number]
+            return
+        self.pool.put(image)
+    def nbytes(self):
+        '''
+        return the memory held by the cached and recycled frames in bytes
+        '''
+        return self.cache.nbytes() + self.pool.nbytes()
+    def clear(self):
+        '''
+        drop the cached and recycled frames, the capture stays open
+        '''
+        self.cache.clear()
+        self.pool.clear()
+        self._borrowed.clear()
+    def release(self):
+        self._capture.release()
+        self.clear()
+    def _decode(self, frame_number):
+        if not self._can_read_forward(frame_number):
+            seek_frame = frame_number
+            if self.keyframe_index is not None:
+                seek_frame = self.keyframe_index.keyframe_before(frame_number)
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, seek_frame)
+            self._next_frame = seek_frame
+            self.seeks += 1
+        while self._next_frame < frame_number:
+            if frame_number - self._next_frame <= self.read_ahead:
+                #frames close to the target are decoded anyway, so keep them for stepping back
+                self._read(self._next_frame)
+            else:
+                self._grab(self._next_frame)
+        return self._read(frame_number)
+    def _can_read_forward(self, frame_number):
+        if not 0 <= self._next_frame <= frame_number:
+            return False
+        if frame_number <= self._next_frame + self.read_ahead:
+            return True
+        #without a keyframe in between, reading on is never slower than seeking back to the GOP start
+        return self.keyframe_index is not None and self.keyframe_index.same_gop(self._next_frame, frame_number)
+    def _grab(self, frame_number):
+        if not self._capture.grab():
+            self._next_frame = -1
+            raise Exception(f'Error reading frame {frame_number}')
+        self._next_frame = frame_number + 1
+    def _read(self, frame_number):
+        #decode into a recycled frame when there is one, the capture allocates otherwise
+        buffer = None if self._shape is None else self.pool.get(self._shape)
+        success, image = self._capture.read(buffer)
+        if not success:
+            self._next_frame = -1
+            raise Exception(f'Error reading frame {frame_number}')
+        self._next_frame = frame_number + 1
+        self._shape = image.shape
+        image.flags.writeable = False
+        self.cache.put(frame_number, image)
+        return image
+
+
+class FramePrefetcher:
+    '''
+    Decode frames ahead of the playhead on a background thread, into a bounded queue.
+    The prefetcher uses its own VideoCapture, so it never competes with the FrameProvider for the decoder.
+    '''
+    def __init__(self, video_path, start_frame, total_frame, direction=1, queue_size=16, store=None):
+        '''
+        video_path: path of the video to decode
+        start_frame: first frame to decode
+        total_frame: number of frames of the video
+        direction: 1 to decode forward, -1 to decode backward
+        queue_size: maximum number of decoded frames waiting to be taken
+        store: optional frame_store.FrameStore of the video, frames are then read from it instead of decoding the video
+        '''
+        self.video_path = video_path
+        self.store = store
+        self.total_frame = total_frame
+        self.direction = direction
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        #bumped on every seek, frames decoded for an older generation are discarded
+        self._generation = 0
+        self._start_frame = start_frame
+        self._expected = start_frame
+        self.delivered = 0
+        self.dropped = 0
+        self.late = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def get(self, frame_number, timeout=0.05):
+        '''
+        return the decoded frame, or None if it is not ready within timeout seconds.
+        Requesting a frame the prefetcher is not heading to re-seeks it to the frame after it.
+        '''
+        if frame_number != self._expected:
+            self.seek(frame_number + self.direction)
+            return None
+        while True:
+            try:
+                generation, decoded_frame, image = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self.late += 1
+                self._expected = frame_number + self.direction
+                return None
+            if generation != self._generation:
+                continue
+            if (decoded_frame - frame_number) * self.direction < 0:
+                #decoded but the playhead already passed it
+                self.dropped += 1
+                continue
+            self._expected = frame_number + self.direction
+            if decoded_frame != frame_number:
+                #the decoder is ahead of the playhead, give it back to the caller to decode synchronously
+                self.seek(self._expected)
+                return None
+            self.delivered += 1
+            return image
+    def seek(self, frame_number):
+        '''
+        restart decoding from frame_number, dropping everything decoded so far
+        '''
+        with self._lock:
+            self._generation += 1
+            self._start_frame = frame_number
+            self._expected = frame_number
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        self._wake.set()
+    def get_stats(self):
+        '''
+        return the number of delivered, dropped and late frames
+        '''
+        return {'delivered': self.delivered, 'dropped': self.dropped, 'late': self.late}
+    def stop(self):
+        '''
+        cancel decoding and wait for the thread to finish
+        '''
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=1)
+    def _run(self):
+        capture = cv2.VideoCapture(self.video_path) if self.store is None else None
+        generation = -1
+        frame_number = 0
+        try:
+            while not self._stopped.is_set():
+                with self._lock:
+                    if generation != self._generation:
+                        generation = self._generation
+                        frame_number = self._start_frame
+                        self._wake.clear()
+                        if capture is not None and 0 <= frame_number < self.total_frame:
+                            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                if not 0 <= frame_number < self.total_frame:
+                    #nothing left to decode in this direction, wait for a seek or stop
+                    self._wake.wait()
+                    continue
+                success, image = self._read(capture, frame_number)
+                if not success:
+                    frame_number = -1
+                    continue
+                image.flags.writeable = False
+                while not self._stopped.is_set() and generation == self._generation:
+                    try:
+                        self._queue.put((generation, frame_number, image), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                frame_number += self.direction
+        finally:
+            if capture is not None:
+                capture.release()
+    def _read(self, capture, frame_number):
+        if self.store is not None:
+            #every frame of a store is read alone, in either direction
+            try:
+                return True, self.store.read(frame_number)
+            except Exception:
+                return False, None
+        if self.direction < 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        return capture.read()
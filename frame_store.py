@@ -0,0 +1,204 @@
+import os
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import cv2
+from frame_provider import FrameCache
+import dataset as ds
+
+#a store is a folder: frames.bin, every frame compressed as an independent JPEG/PNG image one after the other,
+#index.npy, the offset of every frame in frames.bin (frames + 1), and info.json
+DATA_FILE = 'frames.bin'
+INDEX_FILE = 'index.npy'
+INFO_FILE = 'info.json'
+FORMATS = ['jpg', 'png']
+#the export is split between workers in segments of a multiple of this many frames, each decoded sequentially.
+#segments only split the work, every frame of the store is read alone
+SEGMENT_FRAMES = 64
+JPEG_QUALITY = 95
+
+
+def store_path(cache_dir, video_path):
+    '''
+    return the folder of the frame store of a video in the frames folder of a cache folder,
+    keyed on the source file so a changed source is exported again
+    '''
+    return os.path.join(cache_dir, 'frames', ds.source_key(video_path))
+
+def _encode_params(fmt, quality):
+    if fmt == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    #lossless, fast compression: decoding speed matters more than size
+    return [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+def _export_segment(video_path, part_path, start, end, fmt, quality):
+    #decode frames [start, end) in order and append them compressed to part_path, return their sizes
+    capture = cv2.VideoCapture(video_path)
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    params = _encode_params(fmt, quality)
+    sizes = []
+    image = None
+    try:
+        with open(part_path, 'wb') as f:
+            for _ in range(start, end):
+                success, image = capture.read(image)
+                if not success:
+                    break
+                success, data = cv2.imencode('.' + fmt, image, params)
+                if not success:
+                    raise Exception(f'Error encoding frame {start + len(sizes)}')
+                f.write(data.tobytes())
+                sizes.append(len(data))
+    finally:
+        capture.release()
+    return sizes
+
+def export_store(video_path, path, fmt='jpg', quality=JPEG_QUALITY, segment_frames=SEGMENT_FRAMES, jobs=None, force=False):
+    '''
+    export every frame of a video to a frame store at path, return its number of frames, or None if it already exists.
+    Segments of the video are exported by jobs processes, then joined. The store is built in a temporary folder then renamed,
+    so an existing store is always complete
+    '''
+    assert fmt in FORMATS, f'Unknown format: {fmt}'
+    if os.path.isdir(path):
+        if not force:
+            return None
+        shutil.rmtree(path)
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise Exception(f'Can not open {video_path}')
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    info = {'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': capture.get(cv2.CAP_PROP_FPS), 'format': fmt, 'quality': quality, 'segment_frames': segment_frames}
+    capture.release()
+    jobs = jobs if jobs is not None else os.cpu_count()
+    #few enough segments that the seek to each segment start stays cheap
+    segments = max(1, -(-total_frames // segment_frames))
+    task_frames = -(-segments // (jobs * 4)) * segment_frames
+    starts = list(range(0, max(total_frames, 1), task_frames))
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        sizes = [None] * len(starts)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_export_segment, video_path, os.path.join(tmp_path, f'part-{i}'), start,
+                                       min(start + task_frames, total_frames), fmt, quality): i for i, start in enumerate(starts)}
+            for future in as_completed(futures):
+                sizes[futures[future]] = future.result()
+        #only the last segment may end early, when the video has less frames than it reports
+        for i, start in enumerate(starts[:-1]):
+            if len(sizes[i]) < task_frames:
+                raise Exception(f'Error reading frame {start + len(sizes[i])}')
+        with open(os.path.join(tmp_path, DATA_FILE), 'wb') as f:
+            for i in range(len(starts)):
+                part_path = os.path.join(tmp_path, f'part-{i}')
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(part_path)
+        offsets = np.concatenate(([0], np.cumsum(np.concatenate(sizes)))).astype(np.int64)
+        if len(offsets) < 2:
+            raise Exception('No frame could be read')
+        info['frames'] = len(offsets) - 1
+        np.save(os.path.join(tmp_path, INDEX_FILE), offsets)
+        with open(os.path.join(tmp_path, INFO_FILE), 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return info['frames']
+
+
+class FrameStore:
+    '''
+    Frames of a frame store, memory mapped: reading any frame costs one decompress, whatever the codec of the source
+    '''
+    def __init__(self, path):
+        with open(os.path.join(path, INFO_FILE), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.offsets = np.load(os.path.join(path, INDEX_FILE))
+        self._data = np.memmap(os.path.join(path, DATA_FILE), dtype=np.uint8, mode='r')
+    def __len__(self):
+        return len(self.offsets) - 1
+    def read(self, frame_number):
+        '''
+        return the BGR image of a frame
+        '''
+        if not 0 <= frame_number < len(self):
+            raise Exception(f'Error reading frame {frame_number}')
+        image = cv2.imdecode(self._data[self.offsets[frame_number]:self.offsets[frame_number + 1]], cv2.IMREAD_COLOR)
+        if image is None:
+            raise Exception(f'Error decoding frame {frame_number}')
+        return image
+    def close(self):
+        self._data = None
+
+def open_store(path):
+    '''
+    return the FrameStore at path, or None if there is no complete store
+    '''
+    if not os.path.isfile(os.path.join(path, INFO_FILE)):
+        return None
+    try:
+        return FrameStore(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class FrameStoreProvider:
+    '''
+    Serve frames of a FrameStore by frame number, with the same interface as frame_provider.FrameProvider.
+    No decoder position to keep: every frame is read directly, decoded frames are kept in a FrameCache
+    '''
+    def __init__(self, store, cache_frames=120, cache_mb=None):
+        self.store = store
+        self.cache = FrameCache(cache_frames, cache_mb)
+        self.seeks = 0
+    def get(self, frame_number):
+        '''
+        return the BGR image of the frame, the returned array is shared with the cache and read only
+        '''
+        image = self.cache.get(frame_number)
+        if image is None:
+            image = self.store.read(frame_number)
+            image.flags.writeable = False
+            self.cache.put(frame_number, image)
+        return image
+    def adopt(self, frame_number, image):
+        self.cache.put(frame_number, image)
+    def release_frame(self, frame_number, image):
+        #decoded frames are not recycled, imdecode always allocates
+        pass
+    def nbytes(self):
+        return self.cache.nbytes()
+    def clear(self):
+        self.cache.clear()
+    def release(self):
+        self.store.close()
+        self.cache.clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export every frame of every video in metadata.json to a frame store for fast random access')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of processes exporting the segments of each video')
+    parser.add_argument('--cache-dir', default=None, help='cache folder of the editor (default: .hple_cache in the data folder)')
+    parser.add_argument('--format', choices=FORMATS, default='jpg', help='compression of the frames, png is lossless')
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY, help='JPEG quality, 0 to 100')
+    parser.add_argument('--segment-frames', type=int, default=SEGMENT_FRAMES, help='segments exported in parallel are a multiple of this many frames')
+    parser.add_argument('--videos', nargs='+', default=None, help='videos to export (default: all)')
+    parser.add_argument('--force', action='store_true', help='export videos that already have a store')
+    args = parser.parse_args()
+
+    metadata = ds.load_metadata(args.data_path)
+    cache_dir = ds.get_cache_dir(args.data_path, args.cache_dir)
+    tasks = {}
+    for video in ds.select_videos(metadata, args.videos):
+        video_path = os.path.join(args.data_path, metadata[video]['local_path'])
+        tasks[video] = (video_path, store_path(cache_dir, video_path), args.format, args.quality, args.segment_frames, args.jobs, args.force)
+    #the segments of one video are exported in parallel, videos one after the other
+    ds.run_tasks(export_store, tasks, lambda frames: 'store exists' if frames is None else f'{frames} frames')
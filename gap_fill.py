@@ -0,0 +1,136 @@
+import numpy as np
+
+try:
+    from scipy.interpolate import CubicSpline
+except ImportError:
+    CubicSpline = None
+
+#how the missing joints of a frame are filled from the frames around it
+FILL_MODES = ['previous', 'next', 'both']
+INTERPOLATIONS = ['linear', 'spline']
+
+
+def joint_valid(points):
+    '''
+    return the (frames, joints) mask of detected joints of a (frames, joints, dims) track, missing joints are all zero
+    '''
+    return (np.asarray(points) != 0).any(axis=-1)
+
+def nearest_valid(valid):
+    '''
+    return for every frame and joint the last valid frame at or before it (-1 if none)
+    and the first valid frame at or after it (frames if none), from a (frames, joints) mask
+    '''
+    frames = len(valid)
+    dtype = np.int32 if frames < 2**31 - 1 else np.int64
+    index = np.arange(frames, dtype=dtype)[:, None]
+    prev_valid = np.maximum.accumulate(np.where(valid, index, dtype(-1)), axis=0)
+    next_valid = np.minimum.accumulate(np.where(valid, index, dtype(frames))[::-1], axis=0)[::-1]
+    return prev_valid, next_valid
+
+def fill_gaps(points, valid=None, interpolation='linear', max_gap=None, edges=True):
+    '''
+    fill the missing joints of a whole video track in one vectorized pass.
+    points: (frames, joints, dims) track, e.g. a consensus track
+    valid: (frames, joints) mask of the values to keep, default: non zero joints
+    interpolation: 'linear', or 'spline' for a cubic spline through the valid frames of each joint (needs scipy)
+    max_gap: only fill gaps of at most this many frames (None for no limit)
+    edges: fill the frames before the first and after the last valid frame of a joint by holding it
+    return the filled copy of points and the (frames, joints) mask of the joints that are now valid
+    '''
+    assert interpolation in INTERPOLATIONS, f'Unknown interpolation: {interpolation}'
+    points = np.asarray(points)
+    valid = joint_valid(points) if valid is None else np.asarray(valid, dtype=bool)
+    frames, joints = valid.shape
+    if frames == 0:
+        return points.copy(), valid.copy()
+    prev_valid, next_valid = nearest_valid(valid)
+    has_prev = prev_valid >= 0
+    has_next = next_valid < frames
+    inside = has_prev & has_next
+    #length of the gap each missing joint is in, gaps at the edges only end on one side
+    gap = np.where(inside, next_valid - prev_valid - 1, np.where(has_prev, frames - prev_valid - 1, next_valid))
+    fill = ~valid & (inside | (edges & (has_prev | has_next)))
+    if max_gap is not None:
+        fill &= gap <= max_gap
+
+    joint_index = np.arange(joints)[None, :]
+    before = points[np.clip(prev_valid, 0, frames - 1), joint_index]
+    after = points[np.clip(next_valid, 0, frames - 1), joint_index]
+    span = np.maximum(next_valid - prev_valid, 1)
+    weight = (np.arange(frames)[:, None] - prev_valid) / span
+    weight = np.where(inside, weight, np.where(has_prev, 0.0, 1.0))[..., None]
+    result = points.copy()
+    result[fill] = (before + weight * (after - before))[fill]
+
+    if interpolation == 'spline':
+        if CubicSpline is None:
+            raise Exception('Spline interpolation needs scipy: pip install scipy')
+        #only gaps with valid frames on both sides are interpolated, the edges stay held
+        spline_fill = fill & inside
+        for joint in np.flatnonzero(spline_fill.any(axis=0)):
+            known = np.flatnonzero(valid[:, joint])
+            if len(known) < 4:
+                continue
+            missing = np.flatnonzero(spline_fill[:, joint])
+            result[missing, joint] = CubicSpline(known, points[known, joint], axis=0)(missing)
+    return result, valid | fill
+
+
+class GapFiller:
+    '''
+    Fill the missing joints of single frames of a whole video track, e.g. the frame shown in the editor.
+    The valid frames of each joint are indexed once, a frame then costs one binary search per joint.
+    '''
+    def __init__(self, points, valid=None):
+        '''
+        points: (frames, joints, dims) track, kept by reference (it may be memory mapped)
+        valid: (frames, joints) mask of the values to use, default: non zero joints
+        '''
+        self.points = points
+        valid = joint_valid(points) if valid is None else valid
+        self.valid_frames = [np.flatnonzero(valid[:, joint]) for joint in range(valid.shape[1])]
+    def __len__(self):
+        return len(self.points)
+    def neighbors(self, frame):
+        '''
+        return the last valid frame at or before frame (-1 if none)
+        and the first valid frame at or after it (len if none) of every joint
+        '''
+        prev_valid = np.full(len(self.valid_frames), -1, dtype=np.int64)
+        next_valid = np.full(len(self.valid_frames), len(self.points), dtype=np.int64)
+        for joint, known in enumerate(self.valid_frames):
+            i = np.searchsorted(known, frame)
+            if i < len(known):
+                next_valid[joint] = known[i]
+            if i < len(known) and known[i] == frame:
+                prev_valid[joint] = frame
+            elif i > 0:
+                prev_valid[joint] = known[i - 1]
+        return prev_valid, next_valid
+    def fill_frame(self, frame, mode='both'):
+        '''
+        return the (joints, dims) points of a frame with the missing joints filled:
+        'previous' from the last frame the joint was valid, 'next' from the next one,
+        'both' by linear interpolation between them. Joints with no valid frame in that direction stay zero
+        '''
+        assert mode in FILL_MODES, f'Unknown fill mode: {mode}'
+        prev_valid, next_valid = self.neighbors(frame)
+        has_prev = prev_valid >= 0
+        has_next = next_valid < len(self.points)
+        joints = np.arange(len(self.valid_frames))
+        result = np.zeros(np.shape(self.points)[1:], dtype=np.float64)
+        before = np.asarray(self.points[np.clip(prev_valid, 0, len(self.points) - 1), joints], dtype=np.float64)
+        after = np.asarray(self.points[np.clip(next_valid, 0, len(self.points) - 1), joints], dtype=np.float64)
+        if mode == 'previous':
+            result[has_prev] = before[has_prev]
+        elif mode == 'next':
+            result[has_next] = after[has_next]
+        else:
+            inside = has_prev & has_next
+            weight = ((frame - prev_valid) / np.maximum(next_valid - prev_valid, 1))[:, None]
+            result[inside] = (before + weight * (after - before))[inside]
+            #joints missing on one side are held from the other
+            result[has_prev & ~has_next] = before[has_prev & ~has_next]
+            result[has_next & ~has_prev] = after[has_next & ~has_prev]
+        return result
@@ -0,0 +1,114 @@
+import os
+import argparse
+import numpy as np
+import dataset as ds
+
+try:
+    import av
+except ImportError:
+    av = None
+
+#the index is stored next to the video: <video file name>.kfidx.npz
+INDEX_SUFFIX = '.kfidx.npz'
+
+
+class KeyframeIndex:
+    '''
+    Keyframe positions and presentation timestamps of the frames of a video, in presentation order
+    '''
+    def __init__(self, keyframes, pts):
+        '''
+        keyframes: sorted frame numbers of the keyframes
+        pts: presentation timestamp of every frame, in stream time base
+        '''
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.pts = np.asarray(pts, dtype=np.int64)
+    def __len__(self):
+        return len(self.pts)
+    def keyframe_before(self, frame_number):
+        '''
+        return the last keyframe at or before the frame, decoding from it reaches the frame within one GOP
+        '''
+        i = np.searchsorted(self.keyframes, frame_number, side='right') - 1
+        if i < 0:
+            return 0
+        return int(self.keyframes[i])
+    def same_gop(self, frame_a, frame_b):
+        '''
+        return True if both frames are decoded from the same keyframe
+        '''
+        return self.keyframe_before(frame_a) == self.keyframe_before(frame_b)
+
+
+def index_path(video_path):
+    return video_path + INDEX_SUFFIX
+
+def build_index(video_path):
+    '''
+    build the index by demuxing the video, without decoding. Return None if PyAV is not installed
+    '''
+    if av is None:
+        return None
+    pts = []
+    is_keyframe = []
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            #flush packets carry no data
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            is_keyframe.append(packet.is_keyframe)
+    #packets come in decode order, frames are numbered in presentation order
+    pts = np.array(pts, dtype=np.int64)
+    order = np.argsort(pts, kind='stable')
+    is_keyframe = np.array(is_keyframe, dtype=bool)[order]
+    return KeyframeIndex(np.flatnonzero(is_keyframe), pts[order])
+
+def save_index(index, video_path):
+    np.savez(index_path(video_path), keyframes=index.keyframes, pts=index.pts, source=np.array(ds.source_stamp(video_path), dtype=np.int64))
+
+def load_index(video_path, build=True):
+    '''
+    load the index cached next to the video, building and caching it if it is missing or out of date.
+    Return None if there is no index and it can not be built
+    '''
+    path = index_path(video_path)
+    if os.path.isfile(path):
+        try:
+            with np.load(path) as data:
+                #an index is only valid for the exact file it was built from
+                if np.array_equal(data['source'], ds.source_stamp(video_path)):
+                    return KeyframeIndex(data['keyframes'], data['pts'])
+        except (OSError, KeyError, ValueError):
+            pass
+    if not build:
+        return None
+    index = build_index(video_path)
+    if index is not None and len(index) > 0:
+        try:
+            save_index(index, video_path)
+        except OSError:
+            #read only dataset, keep the index for this session only
+            pass
+    return index
+
+def _index_video(video_path, force):
+    if force and os.path.isfile(index_path(video_path)):
+        os.remove(index_path(video_path))
+    index = load_index(video_path)
+    return len(index), len(index.keyframes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the keyframe index of every video in metadata.json')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of videos indexed in parallel')
+    parser.add_argument('--force', action='store_true', help='rebuild existing indexes')
+    args = parser.parse_args()
+    if av is None:
+        raise SystemExit('PyAV is required to build keyframe indexes: pip install av')
+
+    metadata = ds.load_metadata(args.data_path)
+    tasks = {video: (os.path.join(args.data_path, metadata[video]['local_path']), args.force) for video in metadata}
+    ds.run_tasks(_index_video, tasks, lambda result: f'{result[0]} frames, {result[1]} keyframes', args.jobs)
@@ -10,8 +10,15 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 import qdarkgraystyle
 import data_handler as dh
-import pickle as pkl
-import copy
+import skeleton_store as ss
+import consensus as cs
+import gap_fill as gf
+import smoothing as sm
+import metrics as mt
+import review_queue as rq
+import timeline as tl
+from output_data import Outputdata
+from autosave import Autosaver
 
 
 VER = "v1.0"
@@ -19,14 +26,6 @@ tickbox_colors = ["#00ffff", "#008080", "#00ff00", "#808040", "#808080","#8080ff
 average_color = "#ffffff"
 #contains name, points, pixmap image, paths, and landmarkpaths of image
 
-#TODO v1.1: ADD LOCK/UNLOCK FUNCTIONALITY
-class OperationsType:
-    ADD_SKELETON = 0
-    REMOVE_SKELETON = 1
-    ADD_KEYPOINT = 2
-    REMOVE_KEYPOINT = 3
-    MOVE_KEYPOINT = 4
-
 HAND_LINES = [[0,1],[1,2],[2,3],[3,4],
               [0,5],[5,6],[6,7],[7,8],
               [0,9],[9,10],[10,11],[11,12],
@@ -35,123 +34,17 @@ HAND_LINES = [[0,1],[1,2],[2,3],[3,4],
 
 POSE_LINES = [[8,6],[6,5],[5,4],[4,0],[0,1],[1,2],[2,3],[3,7],[9,10],[16,14],[14,12],[12,11],[11,13],[13,15],[15,17]]
 
-class Outputdata:
-    '''
-    For all operations, the output data should be stored in this class:
-    Video > frame > pose/hand
-
-    Save, load, querry
-    Undo, redo
-    '''
-    def __init__(self) -> None:
-        self.data = {}
-        self.history = {}
-        self.history_pointer = 0
-        self.history_frame_count = 0
-        #this to store the most recent frame index of each video. For the purpose of delete the old history
-        self.history_frame_indexs = []
-        self.last_video = None
-
-    def save(self, path):
-        with open(path, 'wb') as f:
-            pkl.dump(self.data, f)
-
-    def load(self, path):
-        with open(path, 'rb') as f:
-            self.data = pkl.load(f)
-
-    def get_skeleton(self, video, frame):
-        if video not in self.data:
-            return None
-        if frame not in self.data[video]:
-            return None
-        return self.data[video][frame]
-    
-    
-    def add_skeleton(self, video, frame, skeleton):
-        if video not in self.data:
-            self.data[video] = {}
-        if self.last_video != video:
-            self.history = {}
-            self.history_pointer = 0
-            self.history_frame_count = 0
-            self.history_frame_indexs = []
-            self.last_video = video
-        self._add_to_history(frame, skeleton)
-        self.data[video][frame] = skeleton
-
-    def remove_skeleton(self, video, frame):
-        self.history.append((OperationsType.REMOVE_SKELETON, video, frame, self.data[video][frame]))
-        self.history_pointer += 1
-        del self.data[video][frame]
-
-    def _add_to_history(self,  frame, data):
-        if frame not in self.history:
-            self.history[frame] = []
-        #if current frame history is more than 50, delete the oldest frame
-        if len(self.history[frame]) > 50:
-            del self.history[frame][0]
-
-
-        self.history[frame].append(copy.deepcopy(data))
-        self.history_pointer  = len(self.history[frame])
-        self.history_frame_count += 1
-        #change the index of the history_frame_indexs
-        #tranverse the history_frame_indexs, if the frame is found then move it to the end
-        #if not found, add it to the end
-        
-        
-
-        if frame in self.history_frame_indexs:
-            self.history_frame_indexs.remove(frame)
-        self.history_frame_indexs.append(frame)
-        #only save the last 10 operations, so delete the oldest frame
-        if len(self.history_frame_indexs) > 10:
-            self.history[ self.history_frame_indexs.pop(0)] = []
-        print(f"Added to history: {frame}/{self.history_pointer}/{len(self.history[frame])}")
-        
-
-    def undo_action(self,video, frame):
-        self.history_pointer = self.history_pointer if self.history_pointer >= 0 and self.history_pointer <= len(self.history[frame]) else len(self.history[frame])
-        if self.history_pointer > 0:
-            self.history_pointer -= 1
-            _temp_data = self.history[frame][self.history_pointer]
-            self.data[video][frame] = copy.deepcopy(_temp_data)
-            print(f"Undo: {frame}/{self.history_pointer}/{len(self.history[frame])}")
-            return frame
-        return None
-
-
-    def redo_action(self,video, frame):
-        if self.history_pointer < len(self.history):
-            _temp_data = self.history[frame][self.history_pointer]
-            self.data[video][frame] = copy.deepcopy(_temp_data)
-            self.history_pointer += 1
-            print(f"Redo: {frame}/{self.history_pointer}/{len(self.history[frame])}")
-            return frame
-        return None
-    def get_undo_redo_status(self,frame):
-        if frame not in self.history:
-            return False, False
-        self.history_pointer = self.history_pointer if self.history_pointer >= 0 and self.history_pointer <= len(self.history[frame]) else len(self.history[frame])
-        
-        #return if can undo, redo
-        return self.history_pointer > 0, self.history_pointer < len(self.history)
-    def get_all_labeled_frames(self, video):
-        #check if video exists
-        if video not in self.data:
-            return 0,[]
-        else:
-            #return the number of labeled frames and a list of labeled frames
-            return len(self.data[video]), list(self.data[video].keys())
-
-
-
-
-
-
-
+def build_adjacency(lines, joints):
+    #for each joint: the joints it draws a line to, and the joints that draw a line to it
+    targets = [[] for _ in range(joints)]
+    parents = [[] for _ in range(joints)]
+    for a, b in lines:
+        targets[a].append(b)
+        parents[b].append(a)
+    return targets, parents
 
+POSE_TARGETS, POSE_PARENTS = build_adjacency(POSE_LINES, 33)
+HAND_TARGETS, HAND_PARENTS = build_adjacency(HAND_LINES, 21)
 
 
 class ImageSet:
@@ -214,7 +107,6 @@ class PhotoViewer(QGraphicsView):
         self._photo = QGraphicsPixmapItem()  # photo that goes into scene
         self._scene.addItem(self._photo)  # add photo into scene
         self.setScene(self._scene)  # set scene into viwer
-        self.pixmap = QPixmap()
         self.realPixmap = QPixmap()
         self.highReso = False #whether the image set is high resolution or not.
 
@@ -224,8 +116,13 @@ class PhotoViewer(QGraphicsView):
     def hasPhoto(self):
         return not self._empty
 
+    def displayScale(self):
+        #screen pixels per source pixel at the current zoom
+        return self.transform().m11() * self.devicePixelRatioF()
+
     def fitInView2(self):
-        rect = QRectF(self._photo.pixmap().rect())
+        #the photo may be a scaled up proxy, its scene rect is always the source frame
+        rect = self._photo.sceneBoundingRect()
         if not rect.isNull():
             self._scene.setSceneRect(rect)
 
@@ -238,7 +135,8 @@ class PhotoViewer(QGraphicsView):
 
             self._zoom = 0
 
-    def setPhoto(self, pixmap=None,changeVideo=False):
+    def setPhoto(self, pixmap=None,changeVideo=False, scale=1.0):
+        #scale: source pixels per pixmap pixel, a downscaled proxy is stretched back so the scene stays in source pixels
         if changeVideo:
             self._zoom = 0
 
@@ -248,24 +146,19 @@ class PhotoViewer(QGraphicsView):
             dwWidth = dw.width()
             dwHeight = dw.height()
 
-            pixmapWidth = pixmap.width()
-            pixmapHeight = pixmap.height()
+            pixmapWidth = pixmap.width() * scale
+            pixmapHeight = pixmap.height() * scale
 
             self.realPixmap = pixmap
 
             if (pixmapWidth > dwWidth) or (pixmapHeight > dwHeight):
-
-                if(pixmapWidth > 10000) or (pixmapHeight > 10000):
-                    self.pixmap = pixmap.scaled(pixmapWidth / 100, pixmapHeight / 100, Qt.KeepAspectRatio)
-                else:
-                    self.pixmap = pixmap.scaled(pixmapWidth / 10, pixmapHeight / 10, Qt.KeepAspectRatio)
-
                 self.highReso = True
             else:
                 self.highReso = False
 
             self._empty = False
             self._photo.setPixmap(pixmap)
+            self._photo.setScale(scale)
 
         else:
             self._empty = True
@@ -335,73 +228,51 @@ class Landmark_path(QGraphicsPathItem):
         self.setFlag(QGraphicsItem.ItemIsMovable, moveable)
         self.setFlag(QGraphicsItem.ItemIsSelectable, moveable)
         self._locked = False
-        self.target_line,self.parent_line = self.get_target()
-        
-        if self.target_line is not None:
-            self.drawLine(self.target_line.x, self.target_line.y)
+        #line items to the target points, by target id. Created once and only moved afterwards
+        self.lines = {}
     
     def setPos(self, x, y):
         self.x = x
         self.y = y
         super(Landmark_path, self).setPos(x, y)
 
-
-    def get_target(self):
-        result_target = None
-        result_parent = None
-        #get the target point of this point
+    def _group(self):
+        #the points of the same skeleton part, indexed by id
         if self.keypoint_class == 'pose':
-            target_index = None
-            parent_index = None
-            for pair in POSE_LINES:
-                if pair[0] == self.id:
-                    target_index = pair[1]
-                elif pair[1] == self.id:
-                    parent_index = pair[0]
-            #find the target point in parent viewer
-            for item in self.parent.currentImage.landmarkPath[self.method]['pose']:
-                if item.id == target_index:
-                    result_target = item
-                elif item.id == parent_index:
-                    result_parent = item
-            return result_target, result_parent
-        elif 'hands' in self.keypoint_class:
-            target_index = None
-            parent_index = None
-            for pair in HAND_LINES:
-                if pair[0] == self.id:
-                    target_index = pair[1]
-                elif pair[1] == self.id:
-                    parent_index = pair[0]
-            #find the target point in parent viewer
-            for item in self.parent.currentImage.landmarkPath[self.method]['hands'][self.keypoint_class.replace('hands','')]:
-                if item.id == target_index:
-                    result_target = item
-                elif item.id == parent_index:
-                    result_parent = item
-            return result_target, result_parent
-    
-
-
-
-
-    def drawLine(self, target_x, target_y):
-        # check if line already exists, if so, modify it; otherwise, create a new line from current position to target position
-        self.removeLine()
-        if not self.parent.show_skeleton:
-            return
-        if hasattr(self, 'line'):
-            self.line.setLine(self.x, self.y, target_x, target_y)
-            self.line.setPen(QPen(self.line_color, 2, Qt.SolidLine, Qt.RoundCap))
-        else:
-            self.line = QGraphicsLineItem(self.x, self.y, target_x, target_y)
-            self.line.setPen(QPen(self.line_color, 2, Qt.SolidLine, Qt.RoundCap))
-            self.parent.viewer.scene().addItem(self.line)
+            return self.parent.currentImage.landmarkPath[self.method]['pose']
+        return self.parent.currentImage.landmarkPath[self.method]['hands'][self.keypoint_class.replace('hands','')]
+
+    def get_targets(self):
+        #points this point draws a line to
+        group = self._group()
+        targets = POSE_TARGETS if self.keypoint_class == 'pose' else HAND_TARGETS
+        return [group[i] for i in targets[self.id] if i < len(group)]
+
+    def get_parents(self):
+        #points that draw a line to this point
+        group = self._group()
+        parents = POSE_PARENTS if self.keypoint_class == 'pose' else HAND_PARENTS
+        return [group[i] for i in parents[self.id] if i < len(group)]
+
+    def update_lines(self):
+        #move the lines from this point to its targets, creating them the first time
+        targets = {target.id: target for target in self.get_targets()}
+        for target_id in [i for i in self.lines if i not in targets]:
+            self.parent.viewer.scene().removeItem(self.lines.pop(target_id))
+        for target_id, target in targets.items():
+            line = self.lines.get(target_id)
+            if line is None:
+                line = QGraphicsLineItem()
+                line.setPen(QPen(self.line_color, 2, Qt.SolidLine, Qt.RoundCap))
+                self.parent.viewer.scene().addItem(line)
+                self.lines[target_id] = line
+            line.setLine(self.x, self.y, target.x, target.y)
+            line.setVisible(self.parent.show_skeleton)
 
     def removeLine(self):
-        if hasattr(self, 'line'):
-            self.parent.viewer.scene().removeItem(self.line)
-            del self.line
+        for line in self.lines.values():
+            self.parent.viewer.scene().removeItem(line)
+        self.lines = {}
 
 
     def setZ(self, z):
@@ -445,12 +316,9 @@ class Landmark_path(QGraphicsPathItem):
         self.x = pos.x()
         self.y = pos.y()
         self.moved = True
-        #self.removeLine()
-        self.target_line,self.parent_line = self.get_target()
-        if self.target_line is not None:
-            self.drawLine(self.target_line.x, self.target_line.y)
-        if self.parent_line is not None:
-            self.parent_line.drawLine(self.x, self.y)
+        self.update_lines()
+        for parent in self.get_parents():
+            parent.update_lines()
         self.parent.update_skeleton()
         if self.parent.recording:
             self.parent.save_current_frame_points()
@@ -467,6 +335,123 @@ class Landmark_path(QGraphicsPathItem):
 
 
 
+class Skeleton_item(QGraphicsItem):
+    '''
+    All points, bones and labels of a read only method skeleton, painted in one item
+    '''
+    def __init__(self, parent, color):
+        super(Skeleton_item, self).__init__()
+        self.parent = parent
+        self.color = QColor(color)
+        self.font = QFont('Times', 1)
+        self._ellipses = []
+        self._bones = []
+        self._labels = []
+        self._rect = QRectF()
+
+    def set_skeleton(self, pose, hands, width, height, EllipSize):
+        #pose: (33, dims) normalized points, hands: {'Right', 'Left'} -> (21, dims) normalized points
+        self.font.setPointSize(EllipSize + 4)
+        self.font.setLetterSpacing(QFont.PercentageSpacing, 150)
+        parts = [('P', pose, POSE_LINES)] + [('L' if hand == 'Left' else 'R', hands[hand], HAND_LINES) for hand in hands]
+        ellipses = []
+        bones = []
+        labels = []
+        corners = []
+        for prefix, points, lines in parts:
+            points = np.asarray(points, dtype=np.float32)
+            if points.size == 0:
+                continue
+            points = points.reshape(len(points), -1)
+            xy = np.stack([(points[:, 0] * width).astype(int), (points[:, 1] * height).astype(int)], axis=1)
+            z = points[:, 2] * 1.2 + 1
+            corners.append(xy)
+            for i, (x, y) in enumerate(xy):
+                ellipses.append(QRectF(x - 2, y - 2, 4 + z[i], 4 + z[i]))
+                labels.append((QPointF(x + 6, y + 5), f"{prefix}{i+1}"))
+            for a, b in lines:
+                if a < len(xy) and b < len(xy):
+                    bones.append(QLineF(xy[a][0], xy[a][1], xy[b][0], xy[b][1]))
+        self.prepareGeometryChange()
+        self._ellipses = ellipses
+        self._bones = bones
+        self._labels = labels
+        if len(corners) > 0:
+            corners = np.concatenate(corners)
+            #room for the ellipses and the labels right of the points
+            margin = 8 + EllipSize
+            x0, y0 = corners.min(axis=0) - margin
+            x1, y1 = corners.max(axis=0) + margin
+            self._rect = QRectF(x0, y0, x1 - x0 + 4 * self.font.pointSize(), y1 - y0 + self.font.pointSize())
+        else:
+            self._rect = QRectF()
+        self.update()
+
+    def boundingRect(self):
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        if self.parent.show_skeleton:
+            painter.setPen(QPen(self.color, 2, Qt.SolidLine, Qt.RoundCap))
+            painter.drawLines(self._bones)
+        painter.setPen(QPen(self.color))
+        painter.setBrush(Qt.NoBrush)
+        for rect in self._ellipses:
+            painter.drawEllipse(rect)
+        if self.parent.view_landmark_name:
+            painter.setFont(self.font)
+            for pos, label in self._labels:
+                painter.drawText(pos, label)
+
+
+class Timeline_strip(QWidget):
+    '''
+    Color strip under the frame slider: labeled frames on the top row, review score (green to red) on the bottom row.
+    It is drawn from a timeline.TimelineSummary image of fixed width, whatever the video length. Clicking a bin selects its frame
+    '''
+    frameClicked = pyqtSignal(int)
+
+    def __init__(self, parent):
+        super(Timeline_strip, self).__init__(parent)
+        self.summary = None
+        self._image = None
+        self.current_frame = 0
+
+    def set_summary(self, summary):
+        self.summary = summary
+        rows = np.ascontiguousarray(np.stack([summary.labeled_colors(), summary.quality_colors()]))
+        self._image = QImage(rows.tobytes(), summary.bins, 2, summary.bins * 3, QImage.Format_RGB888).copy()
+        self.update()
+
+    def set_labeled_count(self, frame, count):
+        #only the bin of the frame is recolored
+        if self.summary is None:
+            return
+        i = self.summary.set_labeled_count(frame, count)
+        r, g, b = self.summary.labeled_colors(slice(i, i + 1))[0]
+        self._image.setPixelColor(i, 0, QColor(int(r), int(g), int(b)))
+        self.update()
+
+    def set_current_frame(self, frame):
+        self.current_frame = frame
+        self.update()
+
+    def paintEvent(self, event):
+        if self._image is None:
+            return
+        painter = QPainter(self)
+        painter.drawImage(self.rect(), self._image)
+        x = int(self.current_frame * self.width() / self.summary.total_frames)
+        painter.setPen(QPen(QColor(255, 255, 255), 1))
+        painter.drawLine(x, 0, x, self.height())
+
+    def mousePressEvent(self, event):
+        if self.summary is None:
+            return
+        frame = int(event.x() * self.summary.total_frames / max(self.width(), 1))
+        self.frameClicked.emit(max(0, min(frame, self.summary.total_frames - 1)))
+
+
 class MainWindow(QMainWindow):
 
     def __init__(self):
@@ -480,27 +465,44 @@ class MainWindow(QMainWindow):
         self._label = QLabel()  # labels that show no photo uploaded warnings
         self.last_frame = -1
         self.currentImage = ImageSet()  # current image
+        self.method_items = {}  # one Skeleton_item per drawn read only method
         self.landmarks_data = {}  # landmarks data of current frame
         self.last_checked_methods = []
         self.checked_methods = []
         self.methods_accuracy = {}
+        self.methods_metrics = {}  # tooltip text of the metrics of each method
+        self.video_metrics = None  # per frame metrics of every method of the current video
+        self.review_queue = None  # frames of the current video from the worst to the best review score
         self.drawn = False #whether landmarks are drawn or not
+        self._rgb_buffer = None  # RGB conversion buffer, only without QImage.Format_BGR888
+        self.display_proxy = True  # show downscaled frames while playing or scrubbing
+        self.proxy_max_scale = 0.9  # frames shown at least this large are always at full resolution
         self.data_path = self.get_data_path()  # get the path of metadata.json
         self.data_folder = os.path.dirname(self.data_path)  # get the path of data folder
-        self.dataloader = dh.DataHandler(self.data_folder)  # initiate data handler
+        self.dataloader = dh.DataHandler(self.data_folder, build_proxies=True)  # initiate data handler
         self.video_list = self.dataloader.get_video_list()  # get the list of videos
         self.alt_names = self.dataloader.get_alt_name()
         self.playing_vid = False  # whether the video is playing or not
         self.current_frame = 0  # current frame
         self.view_landmark_name = True  # whether the landmark name is shown or not
         self.recording = False
+        #set while undo/redo moves to the changed frame: saving the frame being left would clear the redo history
+        self._navigating_history = False
         self.skeleton_source = 'average'
         self.playback_speed = 0.5
+        self.consensus_mode = 'mean'
+        self.smoothing = 'none'  # temporal filter of the method and average skeletons, see smoothing.FILTERS
+        self.consensus_track = None  # average skeleton of every frame for the checked methods
+        self.method_tracks = {}  # smoothed joints of every frame of each checked method, empty without smoothing
+        self.gap_filler = None  # fills missing joints of a frame from the consensus track
         self.show_skeleton = True
+        self.skeleton_shown = True  # whether the drawn lines are currently visible
         self.reset_lock_every_frame = False
         self.save_path = None
         self.gt_data = Outputdata()  # initiate output data
+        self.autosaver = self.create_autosaver()  # saves unsaved labels in the background
         self.initUI()  # initiate UI
+        self.gt_data.add_listener(self.labels_changed)
         #maximize the window
         self.showMaximized()
         #show the window
@@ -511,6 +513,39 @@ class MainWindow(QMainWindow):
         self.viewer.customContextMenuRequested.connect(self.showContextMenu)
         self.record_btn.setEnabled(self.playback_speed != 1)
 
+    def create_autosaver(self, interval=60):
+        #edits are written to the cache folder every interval seconds and every 20 edits,
+        #a file left by a session that did not save is offered for recovery
+        try:
+            path = self.dataloader.get_cache_path('autosave', 'autosave.glmks')
+        except OSError:
+            return None
+        autosaver = Autosaver(self.gt_data, path)
+        if autosaver.has_recovery():
+            answer = QMessageBox.question(self, "Recover labels", "The last session closed with unsaved labels. Recover them?",
+                                          QMessageBox.Yes | QMessageBox.No)
+            if answer == QMessageBox.Yes:
+                try:
+                    autosaver.recover()
+                except Exception as e:
+                    print(f"Could not recover the autosaved labels: {e}")
+                    autosaver.reset()
+            else:
+                autosaver.reset()
+        self.autosave_timer = QTimer()
+        self.autosave_timer.setInterval(interval * 1000)
+        self.autosave_timer.timeout.connect(autosaver.request)
+        self.autosave_timer.start()
+        return autosaver
+    def closeEvent(self, event):
+        self.stop_playback()
+        if self.autosaver is not None:
+            self.autosave_timer.stop()
+            #write the last edits before the window goes away
+            self.autosaver.stop()
+        self.dataloader.stop_proxy_builder()
+        event.accept()
+
     def showContextMenu(self, pos):
         _locked = False
         selectedItems = self.viewer.items()
@@ -691,6 +726,14 @@ class MainWindow(QMainWindow):
         self.frameSlider.setTickPosition(QSlider.TicksBelow)
         self.frameSlider.setTickInterval(200)
         self.frameSlider.valueChanged.connect(self.frameSliderChanged)
+        #the frames shown while dragging may be proxies, show the last one in full
+        self.frameSlider.sliderReleased.connect(self.show_frame)
+
+        self.timeline = Timeline_strip(buttonWidget)
+        self.timeline.move(buttonWidget.x() + 10, buttonWidget.y() + 636)
+        self.timeline.resize(240, 12)
+        self.timeline.setToolTip("Top: labeled frames, bottom: frames to review (red)")
+        self.timeline.frameClicked.connect(self.timeline_clicked)
 
         # create qdockwidget and add the button widget to it
         self.qDockWidget = QDockWidget("")
@@ -840,11 +883,11 @@ class MainWindow(QMainWindow):
         if frame == -1:
             frame = self.current_frame
         if self.last_frame != self.current_frame:
-            if self.recording and 'average' in self.currentImage.landmarkPath:
+            if self.recording and 'average' in self.currentImage.landmarkPath and not self._navigating_history:
                 self.save_current_frame_points()
         self.dataloader.set_current_frame(frame)
         #update the viewer
-        self.viewer.setPhoto(self.get_frame_pixmaps())
+        self.show_frame()
         #update the label
         self.update_label()
 
@@ -855,7 +898,7 @@ class MainWindow(QMainWindow):
             self.update_skeleton_source_btn()
 
         #update undo/redo btn
-        undo_status,redo_status = self.gt_data.get_undo_redo_status(self.dataloader.get_current_frame())
+        undo_status,redo_status = self.gt_data.get_undo_redo_status()
         self.undo_action.setEnabled(undo_status)
         self.redo_action.setEnabled(redo_status)
 
@@ -876,35 +919,70 @@ class MainWindow(QMainWindow):
             if self.skeleton_source != 'average':
                 self.skeleton_source_btn_clicked()
             self.skeleton_source_btn.setEnabled(False)
-    def get_frame_pixmaps(self):
-        cv_img = self.dataloader.get_frame()
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        #convert to pixmap
+    def get_proxy_scale(self):
+        '''
+        return the scale of the frame to display: below 1 (a display proxy) while playing or scrubbing
+        a frame shown smaller than its source, 1 (full resolution) when paused or zoomed in past 1:1
+        '''
+        if not self.display_proxy or not (self.timer.isActive() or self.frameSlider.isSliderDown()):
+            return 1.0
+        scale = self.viewer.displayScale()
+        return scale if scale < self.proxy_max_scale else 1.0
+    def show_frame(self):
+        scale = self.get_proxy_scale()
+        pixmap = self.get_frame_pixmaps(scale)
+        width, _ = self.dataloader.get_video_dimension()
+        self.viewer.setPhoto(pixmap, scale=width / pixmap.width() if scale < 1 else 1.0)
+    def get_frame_pixmaps(self, scale=1.0):
+        cv_img = self.dataloader.get_frame() if scale >= 1 else self.dataloader.get_proxy_frame(scale)
         height, width, channel = cv_img.shape
-        bytesPerLine = 3 * width
-        qImg = QImage(cv_img.data, width, height, bytesPerLine, QImage.Format_RGB888)
+        if hasattr(QImage, 'Format_BGR888'):
+            #Qt >= 5.14 reads the BGR frame as is, the QImage only wraps it
+            qImg = QImage(cv_img.data, width, height, cv_img.strides[0], QImage.Format_BGR888)
+        else:
+            if self._rgb_buffer is None or self._rgb_buffer.shape != cv_img.shape:
+                self._rgb_buffer = np.empty_like(cv_img)
+            cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB, dst=self._rgb_buffer)
+            qImg = QImage(self._rgb_buffer.data, width, height, self._rgb_buffer.strides[0], QImage.Format_RGB888)
         pixmap = QPixmap.fromImage(qImg)
+        #the pixmap holds its own copy, the frame memory can be reused
+        self.dataloader.release_frame(cv_img)
         return pixmap
     
     def get_accuracy(self):
-        d = {}
+        #the confidence of every frame is computed once per video (see metrics.py), this only looks it up
+        frame = self.dataloader.get_current_frame()
+        self.methods_metrics = {}
         for method in self.dataloader.get_current_method_list():
-            d[method] = []
-            pose,hands = self.dataloader.get_current_frame_skeleton(method)
-            for point in pose:
-                d[method].append(point[3])
-            for hand in hands:
-                for i in range(21):
-                    d[method].append(hands[hand]['score'])
-            avg = np.mean(np.array(d[method], dtype=np.float32))
+            if self.video_metrics is None or method not in self.video_metrics.methods:
+                self.methods_accuracy[method] = "-"
+                continue
+            confidence = self.video_metrics.get(method, frame, 'confidence')
             #formart to 100.00%
-            self.methods_accuracy[method] = f"{avg*100:.2f}%"
+            self.methods_accuracy[method] = "-" if np.isnan(confidence) else f"{confidence*100:.2f}%"
+            self.methods_metrics[method] = '\n'.join(f"{mt.METRIC_NAMES[metric]}: {self.video_metrics.get(method, frame, metric):.4f}" for metric in mt.METRICS)
         #update the table
         self.update_accuracy_table()
+    def update_video_metrics(self):
+        #metrics of every method when they were computed before (e.g. by metrics.py), without loading any method,
+        #else computed for the checked methods only, which update_consensus_track loads anyway
+        self.video_metrics = mt.get_cached_video_metrics(self.dataloader)
+        if self.video_metrics is not None or len(self.checked_methods) == 0:
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.video_metrics = mt.get_video_metrics(self.dataloader, self.checked_methods)
+        except Exception as e:
+            print(f"Could not compute the metrics of {self.current_video}: {e}")
+            self.video_metrics = None
+        finally:
+            QApplication.restoreOverrideCursor()
     def update_accuracy_table(self):
         for i, method in enumerate(self.methods_accuracy):
             self.accuracyTable.setItem(i, 0, QTableWidgetItem(method))
-            self.accuracyTable.setItem(i, 1, QTableWidgetItem(self.methods_accuracy[method]))
+            item = QTableWidgetItem(self.methods_accuracy[method])
+            item.setToolTip(self.methods_metrics.get(method, ''))
+            self.accuracyTable.setItem(i, 1, item)
 
     def update_skeleton(self):
             
@@ -914,10 +992,16 @@ class MainWindow(QMainWindow):
             hand_len = 0
             self.last_checked_methods = self.checked_methods
             self.landmarks_data = {}
+            frame = self.dataloader.get_current_frame()
             for method in self.checked_methods:
                 pose,hand = self.dataloader.get_current_frame_skeleton(method)
                 pose_len = len(pose)
                 _hand = {hand[idx]['class']:hand[idx]['landmarks'] for idx in hand}
+                if method in self.method_tracks and frame < len(self.method_tracks[method]):
+                    #the smoothed track, only where the method detected the pose or the hand
+                    smoothed_pose, smoothed_hands = ss.joints_to_skeleton(self.method_tracks[method][frame])
+                    pose = smoothed_pose if len(pose) > 0 else pose
+                    _hand = {hand_class: smoothed_hands[hand_class] for hand_class in _hand}
                 hand_len = 21
                 self.landmarks_data[method] = [pose, _hand]
 
@@ -931,39 +1015,33 @@ class MainWindow(QMainWindow):
             if current_frame_gt and self.skeleton_source == 'saved':
                 self.landmarks_data['average'] = self.load_frame_points(self.dataloader.get_current_frame())
             elif len(self.checked_methods) > 0:
-                tmp_average = []
-                tmp_count = []
-                for method in self.checked_methods:
-                    #calculate the average of all the points, ignore the 0,0 points
-                    pose,hand = self.landmarks_data[method]
-                    if len(tmp_average) == 0:
-                        tmp_average = [np.zeros((33, 4)), np.zeros((21, 4)), np.zeros((21, 4))]
-                        tmp_count = [np.zeros(_.shape) for _ in tmp_average]
-                        
-                    
-                    tmp_average[0] += np.array(pose)
-                    if 'Right' in hand:
-                        tmp_average[1] += np.array(hand['Right'])
-                        tmp_count[1] += (np.array(hand['Right']) != 0) * 1
-                    if 'Left' in hand:
-                        tmp_average[2] += np.array(hand['Left'])
-                        tmp_count[2] += (np.array(hand['Left']) != 0) * 1
-                    tmp_count[0] += (np.array(pose) != 0) * 1
-                    
-                    
-                        
-                tmp_average[0] /= tmp_count[0]
-                tmp_average[1] /= tmp_count[1]
-                tmp_average[2] /= tmp_count[2]
-                #replace all inf with 0
-                tmp_average[0][np.isinf(tmp_average[0])] = 0
-                tmp_average[1][np.isinf(tmp_average[1])] = 0
-                tmp_average[2][np.isinf(tmp_average[2])] = 0
-
-                tmp_average[0][np.isnan(tmp_average[0])] = 0
-                tmp_average[1][np.isnan(tmp_average[1])] = 0
-                tmp_average[2][np.isnan(tmp_average[2])] = 0
-                self.landmarks_data['average'] = [tmp_average[0].tolist(), {'Right':tmp_average[1].tolist(), 'Left':tmp_average[2].tolist()}]
+                if self.consensus_track is not None and frame < len(self.consensus_track):
+                    average = self.consensus_track[frame]
+                else:
+                    #combine the checked methods, joints a method did not detect are ignored
+                    points = []
+                    scores = []
+                    for method in self.checked_methods:
+                        _points, _scores = self.dataloader.get_joints(method, frame)
+                        points.append(_points)
+                        scores.append(_scores)
+                    average = cs.consensus(np.stack(points), weights=np.stack(scores), mode=self.consensus_mode)
+                self.landmarks_data['average'] = ss.joints_to_skeleton(average)
+    def update_consensus_track(self):
+        #the average of every frame is computed (or loaded from the cache) once per method set and mode,
+        #update_skeleton then only looks the frame up, so do the smoothed tracks of the methods
+        self.consensus_track = None
+        self.method_tracks = {}
+        self.gap_filler = None
+        if len(self.checked_methods) == 0:
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.consensus_track = sm.get_smoothed_consensus(self.dataloader, self.checked_methods, self.consensus_mode, filter_name=self.smoothing)
+            if self.smoothing != 'none':
+                self.method_tracks = {method: sm.get_smoothed_method(self.dataloader, method, filter_name=self.smoothing) for method in self.checked_methods}
+        finally:
+            QApplication.restoreOverrideCursor()
     def save_current_frame_points(self):
         pixmapWidth, pixmapHeight = self.dataloader.get_video_dimension()
         _t = np.array([pixmapWidth, pixmapHeight, 1])
@@ -985,6 +1063,8 @@ class MainWindow(QMainWindow):
                 landmarks[1 if hand == 'Right' else 2][i] = pos / _t
         #save the points to the output data
         self.gt_data.add_skeleton(self.dataloader.get_current_video(), self.dataloader.get_current_frame(), landmarks)
+        if self.autosaver is not None:
+            self.autosaver.edited()
     def load_frame_points(self, frame):
         #get the points of the frame from the output data, format simmilar to self.landmarks_data['average']
         #return None if the frame is not labeled
@@ -1029,104 +1109,99 @@ class MainWindow(QMainWindow):
                             self.currentImage.landmarkPath[method]['hands'][hand][i].removeLine()
                             self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['hands'][hand][i])
                         self.currentImage.landmarkPath[method]['hands'][hand] = []
+            #read only methods are drawn as a single item each
+            for method in list(self.method_items):
+                if method not in self.landmarks_data or is_average_only_:
+                    self.viewer.scene().removeItem(self.method_items.pop(method))
+            #points whose position changed, only their lines and the lines ending at them are updated
+            dirty = set()
             for method in self.landmarks_data:
                 if is_average_only_ and method != 'average':
                     continue
                 pose = self.landmarks_data[method][0]
                 hands = self.landmarks_data[method][1]
-                #self.currentImage.landmarkPath
+                method_color = average_color if method == 'average' else tickbox_colors[self.dataloader.get_method_list().index(method)]
+                if method != 'average':
+                    if method not in self.method_items:
+                        self.method_items[method] = Skeleton_item(self, method_color)
+                        self.viewer.addItem(self.method_items[method])
+                    self.method_items[method].set_skeleton(pose, hands, pixmapWidth, pixmapHeight, EllipSize)
+                    continue
+                #the average skeleton keeps one draggable item per point
                 #draw pose
                 if method not in self.currentImage.landmarkPath:
                     self.currentImage.landmarkPath[method] = {'pose':[], 'hands':{}}
-                method_color = average_color if method == 'average' else tickbox_colors[self.dataloader.get_method_list().index(method)]
-                for i, point in enumerate(pose):
-                    #if the point is not drawn, draw it
-                    if len(self.currentImage.landmarkPath[method]['pose']) <= i:
-                        path = QPainterPath()
-                        font = QFont('Times', 1)
-                        font.setPointSize(EllipSize + 4)
-                        font.setLetterSpacing(QFont.PercentageSpacing, 150)
-                        #show text: P1:visibility.2f
-                        if self.view_landmark_name:
-                            path.addText(6, 5, font, f"P{i+1}")
-                        z = (point[2]*1.2 + 1)
-                        rect = QRectF(-2, -2, 4 + z, 4 + z)
-                        path.addEllipse(rect)
-                        qPen = QPen()
-                        qPen.setColor(QColor(method_color))
-                        landmark_path = Landmark_path(path,i,'pose', self,method,QColor(method_color))
-                        landmark_path.setPos(int(point[0]*pixmapWidth), int(point[1]*pixmapHeight))
-                        landmark_path.setZ(point[2])
-                        landmark_path.setPen(qPen)
-                        self.currentImage.landmarkPath[method]['pose'].append(landmark_path)
-                        self.viewer.addItem(landmark_path)
-                    else:
-                        #if the point is already drawn, update it
-                        landmark_path = self.currentImage.landmarkPath[method]['pose'][i]
-                        if not landmark_path.is_locked() or (point[0] != 0 and point[1] != 0):
-                            landmark_path.setPos(int(point[0]*pixmapWidth), int(point[1]*pixmapHeight))
-                            landmark_path.setZ(point[2])
-                            if not self.show_skeleton:
-                                landmark_path.removeLine()
-                            #update label
-
-                            landmark_path.reset()
-                            #if the number of points is less than the number of tickboxes, remove the extra points
-                            if len(self.currentImage.landmarkPath[method]['pose']) > len(pose):
-                                for i in range(len(pose), len(self.currentImage.landmarkPath[method]['pose'])):
-                                    self.currentImage.landmarkPath[method]['pose'][i].removeLine()
-                                    self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['pose'][i])
-                                self.currentImage.landmarkPath[method]['pose'] = self.currentImage.landmarkPath[method]['pose'][:len(pose)]
-                for keypoint in self.currentImage.landmarkPath[method]['pose']:
-                    target_line,_ = keypoint.get_target()
-                    if target_line is not None:
-                        keypoint.drawLine(target_line.x, target_line.y)
+                self.draw_keypoints(method, 'pose', pose, method_color, EllipSize, dirty)
                 #draw hands
                 for hand in hands:
                     if hand not in self.currentImage.landmarkPath[method]['hands']:
                         self.currentImage.landmarkPath[method]['hands'][hand] = []
-                    for i, point in enumerate(hands[hand]):
-                        #if the point is not drawn, draw it
-                        if len(self.currentImage.landmarkPath[method]['hands'][hand]) <= i:
-                            path = QPainterPath()
-                            font = QFont('Times', 1)
-                            font.setPointSize(EllipSize + 4)
-                            font.setLetterSpacing(QFont.PercentageSpacing, 150)
-                            #show text: P1:visibility.2f
-                            if self.view_landmark_name:
-                                path.addText(6, 5, font, f"{'L' if hand == 'Left' else 'R'}{i+1}")
-                            z = (point[2]*1.2 + 1)
-                            rect = QRectF(-2, -2, 4 + z, 4 + z)
-                            path.addEllipse(rect)
-                            qPen = QPen()
-                            qPen.setColor(QColor(method_color))
-                            landmark_path = Landmark_path(path, i,'hands'+hand, self,method,QColor(method_color))
-                            landmark_path.setPos(int(point[0]*pixmapWidth), int(point[1]*pixmapHeight))
-                            landmark_path.setZ(point[2])
-                            landmark_path.setPen(qPen)
-                            self.currentImage.landmarkPath[method]['hands'][hand].append(landmark_path)
-                            self.viewer.addItem(landmark_path)
-                        else:
-                            #if the point is already drawn, update it
-                            landmark_path = self.currentImage.landmarkPath[method]['hands'][hand][i]
-                            if not landmark_path.is_locked():
-                                landmark_path.setPos(int(point[0]*pixmapWidth), int(point[1]*pixmapHeight))
-                                landmark_path.setZ(point[2])
-                                if not self.show_skeleton:
-                                    landmark_path.removeLine()
-                                #update label
-                                landmark_path.reset()
-                                #if the number of points is less than the number of tickboxes, remove the extra points
-                                if len(self.currentImage.landmarkPath[method]['hands'][hand]) > len(hands[hand]):
-                                    for i in range(len(hands[hand]), len(self.currentImage.landmarkPath[method]['hands'][hand])):
-                                        self.currentImage.landmarkPath[method]['hands'][hand][i].removeLine()
-                                        self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['hands'][hand][i])
-                                    self.currentImage.landmarkPath[method]['hands'][hand] = self.currentImage.landmarkPath[method]['hands'][hand][:len(hands[hand])]
-                for hand in self.currentImage.landmarkPath[method]['hands']:
-                    for keypoint in self.currentImage.landmarkPath[method]['hands'][hand]:
-                        target_line,_ = keypoint.get_target()
-                        if target_line is not None:
-                            keypoint.drawLine(target_line.x, target_line.y)
+                    self.draw_keypoints(method, 'hands' + hand, hands[hand], method_color, EllipSize, dirty)
+            #showing or hiding the skeleton touches every line
+            if self.show_skeleton != self.skeleton_shown:
+                self.skeleton_shown = self.show_skeleton
+                for method in self.currentImage.landmarkPath:
+                    dirty.update(self.currentImage.landmarkPath[method]['pose'])
+                    for hand in self.currentImage.landmarkPath[method]['hands']:
+                        dirty.update(self.currentImage.landmarkPath[method]['hands'][hand])
+            to_update = set(dirty)
+            for keypoint in dirty:
+                to_update.update(keypoint.get_parents())
+            for keypoint in to_update:
+                keypoint.update_lines()
+    def draw_keypoints(self, method, keypoint_class, points, method_color, EllipSize, dirty):
+        pixmapWidth, pixmapHeight = self.dataloader.get_video_dimension()
+        if keypoint_class == 'pose':
+            drawn = self.currentImage.landmarkPath[method]['pose']
+        else:
+            drawn = self.currentImage.landmarkPath[method]['hands'][keypoint_class.replace('hands', '')]
+        for i, point in enumerate(points):
+            #if the point is not drawn, draw it
+            if len(drawn) <= i:
+                path = QPainterPath()
+                font = QFont('Times', 1)
+                font.setPointSize(EllipSize + 4)
+                font.setLetterSpacing(QFont.PercentageSpacing, 150)
+                #show text: P1, R1 or L1
+                if self.view_landmark_name:
+                    if keypoint_class == 'pose':
+                        path.addText(6, 5, font, f"P{i+1}")
+                    else:
+                        path.addText(6, 5, font, f"{'L' if keypoint_class == 'handsLeft' else 'R'}{i+1}")
+                z = (point[2]*1.2 + 1)
+                rect = QRectF(-2, -2, 4 + z, 4 + z)
+                path.addEllipse(rect)
+                qPen = QPen()
+                qPen.setColor(QColor(method_color))
+                landmark_path = Landmark_path(path, i, keypoint_class, self, method, QColor(method_color))
+                landmark_path.setPos(int(point[0]*pixmapWidth), int(point[1]*pixmapHeight))
+                landmark_path.setZ(point[2])
+                landmark_path.setPen(qPen)
+                drawn.append(landmark_path)
+                self.viewer.addItem(landmark_path)
+                dirty.add(landmark_path)
+            else:
+                #if the point is already drawn, move it if it is not locked
+                landmark_path = drawn[i]
+                if keypoint_class == 'pose':
+                    movable = not landmark_path.is_locked() or (point[0] != 0 and point[1] != 0)
+                else:
+                    movable = not landmark_path.is_locked()
+                if movable:
+                    x, y = int(point[0]*pixmapWidth), int(point[1]*pixmapHeight)
+                    if x != landmark_path.x or y != landmark_path.y:
+                        landmark_path.setPos(x, y)
+                        dirty.add(landmark_path)
+                    landmark_path.setZ(point[2])
+                    landmark_path.reset()
+        #if more points are drawn than given, remove the extra points
+        if len(drawn) > len(points):
+            for landmark_path in drawn[len(points):]:
+                landmark_path.removeLine()
+                self.viewer.scene().removeItem(landmark_path)
+            del drawn[len(points):]
+            #lines to the removed points are dropped by their owners
+            dirty.update(drawn)
     def _create_menu_bar(self):
         self.menu_bar = self.menuBar()
         self.file_menu = self.menu_bar.addMenu("File")
@@ -1172,6 +1247,16 @@ class MainWindow(QMainWindow):
         self.redo_action.triggered.connect(self.redo_action_triggered)
         self.edit_menu.addAction(self.redo_action)
 
+        #jump to the frames where the methods disagree the most, skipping labeled ones
+        self.next_review_action = QAction("Next frame to review", self)
+        self.next_review_action.setShortcut("Ctrl+Down")
+        self.next_review_action.triggered.connect(self.next_review_action_triggered)
+        self.edit_menu.addAction(self.next_review_action)
+
+        self.reset_review_action = QAction("Restart review", self)
+        self.reset_review_action.triggered.connect(self.reset_review_action_triggered)
+        self.edit_menu.addAction(self.reset_review_action)
+
         #add a separator, below a select playback speed, with option to tick: 1x, 0.5x, 0.25x, 0.1x
         self.edit_menu.addSeparator()
 
@@ -1198,6 +1283,17 @@ class MainWindow(QMainWindow):
             self.playback_speed_actions[option].setChecked(option == 0.5)
             self.playback_speed_actions[option].triggered.connect(self.playback_speed_action_triggered)
             self.playback_speed_menu.addAction(self.playback_speed_actions[option])
+
+        #how the checked methods are combined into the average skeleton
+        self.consensus_mode_menu = QMenu("Average mode", self)
+        self.edit_menu.addMenu(self.consensus_mode_menu)
+        self.consensus_mode_actions = {}
+        for mode in cs.MODES:
+            self.consensus_mode_actions[mode] = QAction(cs.MODE_NAMES[mode], self)
+            self.consensus_mode_actions[mode].setCheckable(True)
+            self.consensus_mode_actions[mode].setChecked(mode == self.consensus_mode)
+            self.consensus_mode_actions[mode].triggered.connect(self.consensus_mode_action_triggered)
+            self.consensus_mode_menu.addAction(self.consensus_mode_actions[mode])
         
     
 
@@ -1216,6 +1312,24 @@ class MainWindow(QMainWindow):
         self.show_skeleton_action.triggered.connect(self.show_skeleton_action_triggered)
         self.view_menu.addAction(self.show_skeleton_action)
 
+        # temporal filter of the average skeleton, the filtered track is computed once and cached
+        self.smoothing_menu = QMenu("Smoothing", self)
+        self.view_menu.addMenu(self.smoothing_menu)
+        self.smoothing_actions = {}
+        for filter_name in sm.FILTERS:
+            self.smoothing_actions[filter_name] = QAction(sm.FILTER_NAMES[filter_name], self)
+            self.smoothing_actions[filter_name].setCheckable(True)
+            self.smoothing_actions[filter_name].setChecked(filter_name == self.smoothing)
+            self.smoothing_actions[filter_name].triggered.connect(self.smoothing_action_triggered)
+            self.smoothing_menu.addAction(self.smoothing_actions[filter_name])
+
+        # downscaled frames while playing or scrubbing, smoother playback of high resolution videos
+        self.display_proxy_action = QAction("Low resolution playback", self)
+        self.display_proxy_action.setCheckable(True)
+        self.display_proxy_action.setChecked(self.display_proxy)
+        self.display_proxy_action.triggered.connect(self.display_proxy_action_triggered)
+        self.view_menu.addAction(self.display_proxy_action)
+
     def _create_help_menu_actions(self):
         self.about_action = QAction("About", self)
         self.about_action.triggered.connect(self.about_action_triggered)
@@ -1231,6 +1345,8 @@ class MainWindow(QMainWindow):
         if open_dialog.exec_():
             filename = open_dialog.selectedFiles()[0]
             self.gt_data.load(filename)
+            if self.autosaver is not None:
+                self.autosaver.reset()
             self.update_frame()
 
     def reset_lock_action_triggered(self):
@@ -1248,8 +1364,12 @@ class MainWindow(QMainWindow):
             if save_dialog.exec_():
                 self.save_path = save_dialog.selectedFiles()[0]
                 self.gt_data.save(self.save_path)
+                if self.autosaver is not None:
+                    self.autosaver.mark_saved()
         else:
             self.gt_data.save(self.save_path)
+            if self.autosaver is not None:
+                self.autosaver.mark_saved()
     def save_as_action_triggered(self):
         #open a dialog to save the output data with .lmks extension
         #then call the save function from gt
@@ -1261,33 +1381,60 @@ class MainWindow(QMainWindow):
         if save_dialog.exec_():
             filename = save_dialog.selectedFiles()[0]
             self.gt_data.save(filename)
-    def undo_action_triggered(self):
-        #call the undo function from gt and update the viewer
-        undo_frame = self.gt_data.undo_action(self.dataloader.get_current_video(), self.dataloader.get_current_frame())
-
-        #if frame, change to that frame
-        if undo_frame:
-            self.update_frame(undo_frame)
-
-        #change skeleton source to saved if not
-        if self.skeleton_source != 'saved':
-            self.skeleton_source_btn_clicked()
-        self.landmarks_data['average'] = self.load_frame_points(self.dataloader.get_current_frame())
-        
-        
+            if self.autosaver is not None:
+                self.autosaver.mark_saved()
+    def next_review_action_triggered(self):
+        if self.review_queue is None:
+            if self.video_metrics is None:
+                QMessageBox.about(self, "Info", "Check the methods to compare first, the review scores are computed from them")
+                return
+            self.review_queue = rq.ReviewQueue(rq.review_scores(self.video_metrics))
+        desired_frame = self.review_queue.next_frame(lambda frame: self.gt_data.is_labeled(self.current_video, frame))
+        if desired_frame is None or desired_frame >= self.dataloader.get_total_frames():
+            QMessageBox.about(self, "Info", "Every frame has been reviewed")
+            return
+        self.current_frame = desired_frame
         self.update_frame()
-        self.drawPoints(True)
-        
+        self.update_review_status(desired_frame)
+    def reset_review_action_triggered(self):
+        if self.review_queue is not None:
+            self.review_queue.reset()
+        self.update_review_status()
+    def update_review_status(self, frame=None):
+        #the rank of the frame reviewed last, shown in the edit menu
+        if self.review_queue is None or frame is None:
+            self.reset_review_action.setText("Restart review")
+        else:
+            self.reset_review_action.setText(f"Restart review (frame {frame} ranks {self.review_queue.rank(frame) + 1} of {len(self.review_queue)})")
+    def undo_action_triggered(self):
+        #call the undo function from gt and go to the frame it changed
+        self.show_history_change(self.gt_data.undo_action())
 
     def redo_action_triggered(self):
-        #call the redo function from gt and update the viewer
-        redo_frame = self.gt_data.redo_action( self.dataloader.get_current_video(), self.dataloader.get_current_frame())
-        if redo_frame:
-            self.update_frame(redo_frame)
-        if self.skeleton_source != 'saved':
-            self.skeleton_source_btn_clicked()
-        self.landmarks_data['average'] = self.load_frame_points(self.dataloader.get_current_frame())
-        self.update_frame()
+        #call the redo function from gt and go to the frame it changed
+        self.show_history_change(self.gt_data.redo_action())
+    def show_history_change(self, change):
+        if change is None:
+            return
+        if self.autosaver is not None:
+            self.autosaver.edited()
+        video, frame = change
+        status = self.gt_data.get_undo_redo_status()
+        self._navigating_history = True
+        try:
+            #the history covers every video, switch to the one that changed
+            if video != self.current_video and video in self.alt_names:
+                self.videoSource.setCurrentText(self.alt_names[video])
+            self.current_frame = frame
+            self.labeled_frame_count = self.gt_data.get_labeled_count(self.current_video)
+            self.update_frame()
+        finally:
+            self._navigating_history = False
+        #moving to the change must not record a new one, it would drop the redo history
+        assert self.gt_data.get_undo_redo_status() == status, 'Undo/redo navigation edited the labels'
+        #the frame may be the same, refresh the skeleton from the changed labels
+        self.update_skeleton_source_btn()
+        self.update_skeleton()
         self.drawPoints(True)
     def playback_speed_action_triggered(self):
         for option in self.playback_speed_actions:
@@ -1300,21 +1447,38 @@ class MainWindow(QMainWindow):
                         self.playback_speed_actions[_option].setChecked(False)
         #if 1x is selected, disable the record button
         self.record_btn.setEnabled(self.playback_speed < 1)
+    def consensus_mode_action_triggered(self):
+        for mode in self.consensus_mode_actions:
+            if self.consensus_mode_actions[mode] == self.sender():
+                self.consensus_mode = mode
+            self.consensus_mode_actions[mode].setChecked(mode == self.consensus_mode)
+        self.update_consensus_track()
+        self.update_skeleton()
+        self.drawPoints(True)
+    def smoothing_action_triggered(self):
+        for filter_name in self.smoothing_actions:
+            if self.smoothing_actions[filter_name] == self.sender():
+                self.smoothing = filter_name
+            self.smoothing_actions[filter_name].setChecked(filter_name == self.smoothing)
+        self.update_consensus_track()
+        self.update_skeleton()
+        self.drawPoints(True)
     def landmarks_label_action_triggered(self):
         self.view_landmark_name = self.landmarks_label_action.isChecked()
-        for method in self.landmarks_data:
-            #if average tickbox is checked, only draw average
-            is_average = self.average_tickbox.isChecked()
-            if is_average and method != 'average':
-                continue
+        #the labels are part of the point paths, so redraw the average points
+        for method in self.currentImage.landmarkPath:
             for i in range(len(self.currentImage.landmarkPath[method]['pose'])):
-                            self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['pose'][i])
+                self.currentImage.landmarkPath[method]['pose'][i].removeLine()
+                self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['pose'][i])
             self.currentImage.landmarkPath[method]['pose'] = []
             for hand in self.currentImage.landmarkPath[method]['hands']:
                 for i in range(len(self.currentImage.landmarkPath[method]['hands'][hand])):
+                    self.currentImage.landmarkPath[method]['hands'][hand][i].removeLine()
                     self.viewer.scene().removeItem(self.currentImage.landmarkPath[method]['hands'][hand][i])
                 self.currentImage.landmarkPath[method]['hands'][hand] = []
         self.drawPoints(True)
+    def display_proxy_action_triggered(self):
+        self.display_proxy = self.display_proxy_action.isChecked()
     def show_skeleton_action_triggered(self):
         self.show_skeleton = self.show_skeleton_action.isChecked()
         self.update_skeleton()
@@ -1336,12 +1500,20 @@ class MainWindow(QMainWindow):
             if self.methods_tickbox[method].isChecked():
                 self.checked_methods.append(method)
         print(self.checked_methods)
+        self.dataloader.set_active_methods(self.checked_methods)
+        self.update_consensus_track()
+        if self.video_metrics is None or not set(self.checked_methods) <= set(self.video_metrics.methods):
+            self.update_video_metrics()
+            self.review_queue = None
+            self.update_review_status()
+            self.update_timeline()
+        self.get_accuracy()
         self.update_skeleton()
         self.drawPoints(True)
     def videoSourceChanged(self):
         #if timer is running, stop it
         if self.timer.isActive():
-            self.timer.stop()
+            self.stop_playback()
         
         if self.sender() == None:
             selected_alt = self.videoSource.currentText()
@@ -1365,14 +1537,23 @@ class MainWindow(QMainWindow):
                 self.current_video = video
                 break
         self.dataloader.set_video(self.current_video)
+        #a video switched back to resumes at the frame it was left at
+        self.current_frame = self.dataloader.get_current_frame()
+        #the methods checked for the previous video are unchecked below, none is loaded meanwhile
+        self.checked_methods = []
+        self.dataloader.set_active_methods(self.checked_methods)
+        self.update_video_metrics()
+        self.review_queue = None
+        self.update_review_status()
+        self.update_timeline()
         self.videoNameLb.setText(selected_alt)
         self.videoNameLb.adjustSize()
-        self.labeled_frame_count, self.labeled_frames = self.gt_data.get_all_labeled_frames(self.current_video)
+        self.labeled_frame_count = self.gt_data.get_labeled_count(self.current_video)
 
         #end the loading dialog
         self.loading_dialog.close()
         self.frameSlider.setMaximum(self.dataloader.get_total_frames())
-        self.frameSlider.setValue(0)
+        self.frameSlider.setValue(self.current_frame)
         self.frameSlider.setTickInterval(self.dataloader.get_total_frames())
 
 
@@ -1383,6 +1564,9 @@ class MainWindow(QMainWindow):
                f"Avaliable method(s) for this video: {', '.join(self.dataloader.get_current_method_list())}"])
         
         #loop through all the tickboxes and set them to unchecked, and disable them if not in the current method list
+        self.checked_methods = []
+        self.dataloader.set_active_methods(self.checked_methods)
+        self.update_consensus_track()
         for method in self.methods_tickbox:
             self.methods_tickbox[method].setChecked(False)
             if method in self.dataloader.get_current_method_list():
@@ -1394,7 +1578,6 @@ class MainWindow(QMainWindow):
         #show a message box
         QMessageBox.about(self, "Message", msg)
         
-        self.current_frame = 0
         self.dataloader.set_current_frame(self.current_frame)
         self.viewer.setPhoto(self.get_frame_pixmaps(),True)
         self.update_label()
@@ -1407,7 +1590,7 @@ class MainWindow(QMainWindow):
 
 
         #update self.videoProgressLb
-        self.labeled_frame_count, self.labeled_frames = self.gt_data.get_all_labeled_frames(self.current_video)
+        self.labeled_frame_count = self.gt_data.get_labeled_count(self.current_video)
         _txt = f"Labeled {self.labeled_frame_count} out of {self.dataloader.get_total_frames()} frames ({self.labeled_frame_count/self.dataloader.get_total_frames():.2%})"
         self.videoProgressLb.setText(_txt)
         self.videoProgressLb.adjustSize()
@@ -1434,12 +1617,27 @@ class MainWindow(QMainWindow):
         self.frameSlider.blockSignals(True)
         self.frameSlider.setValue(self.current_frame)
         self.frameSlider.blockSignals(False)
+        self.timeline.set_current_frame(self.current_frame)
 
 
 
 
 
 
+    def update_timeline(self):
+        scores = rq.review_scores(self.video_metrics) if self.video_metrics is not None else None
+        labeled = self.gt_data.data[self.current_video].frames() if self.current_video in self.gt_data.data else []
+        self.timeline.set_summary(tl.TimelineSummary(self.dataloader.get_total_frames(), self.timeline.width(), labeled, scores))
+    def labels_changed(self, video, frame):
+        #called by gt_data after every change, only the bin of the changed frame is recomputed
+        if video is None:
+            self.update_timeline()
+        elif video == self.current_video and self.timeline.summary is not None:
+            start, end = self.timeline.summary.bin_range(frame)
+            self.timeline.set_labeled_count(frame, self.gt_data.get_labeled_count(video, start, end))
+    def timeline_clicked(self, frame):
+        self.current_frame = frame
+        self.update_frame()
     def frameSliderChanged(self):
         #check if user interacted with the slider
         # if self.playing_vid:
@@ -1498,120 +1696,45 @@ class MainWindow(QMainWindow):
         dialog.exec()
 
     def get_average_skeleton(self, skeletons):
-        tmp_average = []
-        tmp_count = []
-        for (pose,hand) in skeletons:
-            #calculate the average of all the points, ignore the 0,0 points
-            if len(tmp_average) == 0:
-                tmp_average = [np.zeros((33, 4)), np.zeros((21, 4)), np.zeros((21, 4))]
-                tmp_count = [np.zeros(_.shape) for _ in tmp_average]
-                
-            tmp_pose_np = np.array(pose)
-            if tmp_average[0].shape != tmp_pose_np.shape:
-                #padd the tmp_average to the same shape as tmp_pose_np
-                tmp_average[0] = np.pad(tmp_average[0], ((0, tmp_pose_np.shape[0] - tmp_average[0].shape[0]), (0, 0)), 'constant', constant_values=(0))
-            tmp_average[0] += tmp_pose_np
-            if 'Right' in hand:
-                tmp_average[1] += np.array(hand['Right'])
-                tmp_count[1] += (np.array(hand['Right']) != 0) * 1
-            if 'Left' in hand:
-                tmp_average[2] += np.array(hand['Left'])
-                tmp_count[2] += (np.array(hand['Left']) != 0) * 1
-            tmp_count[0] += (np.array(pose) != 0) * 1
-            
-            
-                
-        tmp_average[0] /= tmp_count[0]
-        tmp_average[1] /= tmp_count[1]
-        tmp_average[2] /= tmp_count[2]
-        #replace all inf with 0
-        tmp_average[0][np.isinf(tmp_average[0])] = 0
-        tmp_average[1][np.isinf(tmp_average[1])] = 0
-        tmp_average[2][np.isinf(tmp_average[2])] = 0
-
-        tmp_average[0][np.isnan(tmp_average[0])] = 0
-        tmp_average[1][np.isnan(tmp_average[1])] = 0
-        tmp_average[2][np.isnan(tmp_average[2])] = 0
-        return [tmp_average[0].tolist(), {'Right':tmp_average[1].tolist(), 'Left':tmp_average[2].tolist()}]
-    def get_average_skeleton_from_frame_seq(self, frames_range,methods):
-        skeletons = []
-        for desired_frame in frames_range:
-            satify_pose,satify_hands = False,False
-            skeletons = []
-            for method in methods:
-                pose,hand = self.dataloader.get_skeleton( method,desired_frame)
-                _hand = {hand[idx]['class']:hand[idx]['landmarks'] for idx in hand}
-                if pose is not None and satify_pose == False:
-                    if len(pose) == 33:
-                        satify_pose = True
-                if _hand is not None and satify_hands == False:
-                    if len(_hand) == 2:
-                        if len(_hand['Right']) == 21 and len(_hand['Left']) == 21:
-                            satify_hands = True
-                skeletons.append([pose,_hand])            
-            if satify_pose and satify_hands:
-                break
-        desired_skeleton = self.get_average_skeleton(skeletons)
-        return desired_skeleton
+        #combine [pose, {'Right', 'Left'}] skeletons, ignoring the 0,0 points
+        points = np.stack([ss.skeleton_to_joints(pose, hand) for (pose, hand) in skeletons])
+        return ss.joints_to_skeleton(cs.consensus(points, mode=self.consensus_mode))
+    def get_gap_filler(self):
+        #the valid frames of each joint of the consensus track are indexed once per track
+        if self.gap_filler is None and self.consensus_track is not None:
+            self.gap_filler = gf.GapFiller(self.consensus_track)
+        return self.gap_filler
     def calculate_average_btn_clicked_action(self, action):
         print(f"Action {action} clicked")
         #close the dialog
         self.sender().parent().close()
         #get the desired frame
         desired_frame = self.current_frame
-        desired_skeleton = None
-        selected_methods = self.checked_methods
-        if action == 1:
-            r = range(desired_frame, 0, -1)
-            desired_skeleton = self.get_average_skeleton_from_frame_seq(r,selected_methods)
-        if action == 2:
-            f_r = range(desired_frame,self.dataloader.get_total_frames())
-            b_r = range(desired_frame, 0, -1)
-            f_skeleton = self.get_average_skeleton_from_frame_seq(f_r,selected_methods)
-            b_skeleton = self.get_average_skeleton_from_frame_seq(b_r,selected_methods)
-            desired_skeleton = self.get_average_skeleton([f_skeleton,b_skeleton])
-        if action == 3:
-            r = range(desired_frame,self.dataloader.get_total_frames())
-            desired_skeleton = self.get_average_skeleton_from_frame_seq(r,selected_methods)
+        gap_filler = self.get_gap_filler()
+        if gap_filler is None or desired_frame >= len(gap_filler):
+            return
+        #each joint is taken from the nearest frame where it was detected: 1 before, 3 after, 2 interpolated between them
+        mode = {1: 'previous', 2: 'both', 3: 'next'}[action]
+        desired_skeleton = ss.joints_to_skeleton(gap_filler.fill_frame(desired_frame, mode))
         #set gt
         self.landmarks_data['average'] = self.get_average_skeleton([desired_skeleton,self.landmarks_data['average']])
         self.drawPoints(True)
         if self.recording:
             self.save_current_frame_points()
 
-        
-        
-                        
-
     def pre_not_labeled_btn_clicked(self):
-        self.labeled_frame_count, self.labeled_frames = self.gt_data.get_all_labeled_frames(self.current_video)
-        desired_frame = self.current_frame
-        found = False
-        while desired_frame > 0 and not found:
-            if desired_frame not in self.labeled_frames:
-                found = True
-                break
-            desired_frame -= 1
+        desired_frame = self.gt_data.get_prev_unlabeled(self.current_video, self.current_frame)
         #if not found, show a message box
-        if not found:
+        if desired_frame is None:
             QMessageBox.about(self, "Info", "All frames before this have been labeled")
             return
         #set desired frame
         self.current_frame = desired_frame
         self.update_frame()
     def next_not_labeled_btn_clicked(self):
-        self.labeled_frame_count, self.labeled_frames = self.gt_data.get_all_labeled_frames(self.current_video)
-        #loop from current frame to when the next not labeled frame is found
-        desired_frame = self.current_frame
-
-        found = False
-        while desired_frame < self.dataloader.get_total_frames() - 1 and not found:
-            if desired_frame not in self.labeled_frames:
-                found = True
-                break
-            desired_frame += 1
+        desired_frame = self.gt_data.get_next_unlabeled(self.current_video, self.current_frame, self.dataloader.get_total_frames())
         #if not found, show a message box
-        if not found:
+        if desired_frame is None:
             QMessageBox.about(self, "Info", "All frames after this have been labeled")
             return
         #set desired frame
@@ -1643,7 +1766,7 @@ class MainWindow(QMainWindow):
             self.sender().setIcon(record_icon)
             #if playing, stop the timer
             if self.timer.isActive():
-                self.timer.stop()
+                self.stop_playback()
             
             self.save_current_frame_points()
         else:
@@ -1673,17 +1796,32 @@ class MainWindow(QMainWindow):
     def space_pressed(self):
         #play or pause the video when space is pressed
         if self.timer.isActive():
-            self.timer.stop()
+            self.stop_playback()
         else:
-            self.timer.start()
+            self.start_playback()
     def play_btn_clicked(self):
-        self.timer.start()
+        self.start_playback()
     def pause_btn_clicked(self):
+        self.stop_playback()
+    def start_playback(self):
+        if self.timer.isActive():
+            return
+        #decode the next frames in the background while the timer runs, from the proxy of the video if it is shown
+        self.dataloader.start_prefetch(proxy=self.display_proxy and self.viewer.displayScale() < self.proxy_max_scale)
+        self.timer.start()
+    def stop_playback(self):
         self.timer.stop()
+        stats = self.dataloader.stop_prefetch()
+        if stats is not None:
+            print(f"Playback: {stats['delivered']} prefetched, {stats['dropped']} dropped, {stats['late']} late frames")
+        sessions = self.dataloader.get_session_stats()
+        print(f"Video sessions: {sessions['videos']} kept open ({sessions['mb']:.1f} MB), {sessions['hits']} reused, {sessions['misses']} opened")
+        #the frame shown while playing may be a proxy
+        self.show_frame()
     def timer_timeout(self):
         #if the current frame is the last frame, stop the timer
         if self.current_frame == self.dataloader.get_total_frames() - 1:
-            self.timer.stop()
+            self.stop_playback()
             return
         self.current_frame += 1
         self.update_frame()
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import argparse
+import warnings
+import numpy as np
+import dataset as ds
+import consensus as cs
+import gap_fill as gf
+
+#per frame quality metrics of each method
+METRICS = ['confidence', 'disagreement', 'missing', 'jitter']
+METRIC_NAMES = {'confidence': 'Confidence', 'disagreement': 'Disagreement', 'missing': 'Missing joints', 'jitter': 'Jitter'}
+#distances are measured on x, y, normalized to the frame size
+DISTANCE_DIMS = 2
+
+
+def frame_metrics(points, scores, reference):
+    '''
+    compute the metrics of one method over frames, in one vectorized pass.
+    points: (frames, joints, dims) joints of the method, scores: (frames, joints) joint scores,
+    reference: (frames, joints, dims) consensus of all methods
+    return (frames, len(METRICS)) float32, NaN where a metric is undefined (e.g. nothing detected)
+    confidence: mean score of the detected joints
+    disagreement: mean distance of the detected joints to the reference
+    missing: number of joints not detected
+    jitter: mean acceleration (second difference over 3 frames) of the joints detected on all 3 frames
+    '''
+    valid = gf.joint_valid(points)
+    count = valid.sum(axis=1)
+    result = np.full((len(points), len(METRICS)), np.nan, dtype=np.float32)
+    with warnings.catch_warnings():
+        #frames without any detected joint give NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        result[:, 0] = np.where(valid, scores, 0).sum(axis=1) / count
+        xy = points[..., :DISTANCE_DIMS]
+        both = valid & gf.joint_valid(reference)
+        distance = np.linalg.norm(xy - reference[..., :DISTANCE_DIMS], axis=-1)
+        result[:, 1] = np.where(both, distance, 0).sum(axis=1) / both.sum(axis=1)
+        result[:, 2] = valid.shape[1] - count
+        if len(points) >= 3:
+            steady = valid[:-2] & valid[1:-1] & valid[2:]
+            acceleration = np.linalg.norm(xy[2:] - 2 * xy[1:-1] + xy[:-2], axis=-1)
+            result[1:-1, 3] = np.where(steady, acceleration, 0).sum(axis=1) / steady.sum(axis=1)
+    return result
+
+def compute_video_metrics(handler, methods, chunk_frames=8192):
+    '''
+    compute the metrics of every frame of the current video of a DataHandler, as (frames, methods, len(METRICS)).
+    The reference of the disagreement is the consensus of all methods. Frames past the end of the shortest method file are left out
+    '''
+    frames = min(handler.get_method_frame_count(method) for method in methods)
+    result = np.full((frames, len(methods), len(METRICS)), np.nan, dtype=np.float32)
+    #chunks overlap by one frame on each side so the jitter of the chunk edges is defined
+    for start in range(0, frames, chunk_frames):
+        chunk = slice(max(start - 1, 0), min(start + chunk_frames + 1, frames))
+        joints = [handler.get_joints(method, chunk) for method in methods]
+        points = np.stack([points for points, _ in joints], axis=1)
+        reference = cs.consensus(points, mode='mean')
+        keep = slice(start - chunk.start, start - chunk.start + min(chunk_frames, frames - start))
+        for i, (points, scores) in enumerate(joints):
+            result[start:start + chunk_frames, i] = frame_metrics(points, scores, reference)[keep]
+    return result
+
+
+class VideoMetrics:
+    '''
+    Metrics of every frame and method of one video, see compute_video_metrics
+    '''
+    def __init__(self, methods, values):
+        self.methods = list(methods)
+        self.values = values
+    def __len__(self):
+        return len(self.values)
+    def get(self, method, frame, metric='confidence'):
+        '''
+        return one metric of a method at a frame, NaN if undefined or the method or frame is unknown
+        '''
+        if method not in self.methods or not 0 <= frame < len(self.values):
+            return np.nan
+        return float(self.values[frame, self.methods.index(method), METRICS.index(metric)])
+    def get_track(self, metric='confidence'):
+        '''
+        return one metric of every frame and method as (frames, methods)
+        '''
+        return self.values[:, :, METRICS.index(metric)]
+    def summary(self):
+        '''
+        return {method: {metric: mean over the frames}}
+        '''
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = np.nanmean(self.values, axis=0) if len(self.values) > 0 else np.full((len(self.methods), len(METRICS)), np.nan)
+        return {method: {metric: float(means[i, j]) for j, metric in enumerate(METRICS)} for i, method in enumerate(self.methods)}
+
+
+def _cache_name(handler, methods):
+    #the cache is keyed on the method files, only their stamps are read
+    key = {'video': handler.get_current_video(), 'methods': [handler.get_method_stamp(method) for method in methods]}
+    return f"{handler.get_current_video()}-{hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()}.npy"
+
+def get_video_metrics(handler, methods=None):
+    '''
+    return the VideoMetrics of the current video of a DataHandler, from the cache folder if computed before.
+    methods: default every method of the video
+    '''
+    methods = sorted(handler.get_current_method_list() if methods is None else methods)
+    return VideoMetrics(methods, handler.get_cached_array('metrics', _cache_name(handler, methods), lambda: compute_video_metrics(handler, methods), f'{handler.get_current_video()}-'))
+
+def get_cached_video_metrics(handler, methods=None):
+    '''
+    return the VideoMetrics of the current video only if it is in the cache folder, else None. No method file is loaded
+    '''
+    methods = sorted(handler.get_current_method_list() if methods is None else methods)
+    path = os.path.join(handler.cache_dir, 'metrics', _cache_name(handler, methods))
+    if not os.path.isfile(path):
+        return None
+    try:
+        return VideoMetrics(methods, np.load(path, mmap_mode='r'))
+    except (OSError, ValueError):
+        return None
+
+def _video_summary(data_path, video):
+    import data_handler as dh
+    handler = dh.DataHandler(data_path, use_keyframe_index=False, use_proxies=False)
+    handler.set_video(video)
+    metrics = get_video_metrics(handler)
+    return len(metrics), metrics.summary()
+
+def format_summary(summary):
+    lines = []
+    for method in summary:
+        values = ', '.join(f'{METRIC_NAMES[metric]}: {summary[method][metric]:.4f}' for metric in METRICS)
+        lines.append(f'    {method}: {values}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the quality metrics of every method of every video in metadata.json')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of videos processed in parallel')
+    parser.add_argument('--videos', nargs='+', default=None, help='videos to process (default: all)')
+    args = parser.parse_args()
+
+    metadata = ds.load_metadata(args.data_path)
+    tasks = {video: (args.data_path, video) for video in ds.select_videos(metadata, args.videos)}
+    results = ds.run_tasks(_video_summary, tasks, lambda result: f'{result[0]} frames\n{format_summary(result[1])}', args.jobs)
+    #frame weighted totals of every method over the dataset
+    totals = {}
+    for frames, summary in results.values():
+        for method in summary:
+            total = totals.setdefault(method, {'frames': 0, **{metric: 0.0 for metric in METRICS}})
+            total['frames'] += frames
+            for metric in METRICS:
+                if not np.isnan(summary[method][metric]):
+                    total[metric] += summary[method][metric] * frames
+    print('Dataset:')
+    print(format_summary({method: {metric: totals[method][metric] / max(totals[method]['frames'], 1) for metric in METRICS} for method in totals}))
@@ -0,0 +1,602 @@
+import os
+import uuid
+from bisect import bisect_right
+import pickle as pkl
+import numpy as np
+
+#TODO v1.1: ADD LOCK/UNLOCK FUNCTIONALITY
+class OperationsType:
+    ADD_SKELETON = 0
+    REMOVE_SKELETON = 1
+    ADD_KEYPOINT = 2
+    REMOVE_KEYPOINT = 3
+    MOVE_KEYPOINT = 4
+
+#a labeled skeleton is [pose (33, 3), right hand (21, 3), left hand (21, 3)], stored as 75 joints
+LABEL_PARTS = [slice(0, 33), slice(33, 54), slice(54, 75)]
+LABEL_JOINTS = 75
+LABEL_DIMS = 3
+
+#base files written by this version, older files are a pickled {video: {frame: skeleton}} dict
+FILE_FORMAT = 'hple-labels'
+FILE_VERSION = 2
+JOURNAL_SUFFIX = '.journal'
+
+
+class FrameRuns:
+    '''
+    Sorted index of labeled frames as disjoint runs [start, end), two runs never touch.
+    Lookups are a binary search, so count and next/previous unlabeled frame queries never walk the frames
+    '''
+    def __init__(self, frames=()):
+        '''
+        frames: sorted unique frames to start with
+        '''
+        frames = np.asarray(frames, dtype=np.int64)
+        breaks = np.flatnonzero(np.diff(frames) != 1) + 1
+        self.starts = frames[np.concatenate(([0], breaks))].tolist() if len(frames) > 0 else []
+        self.ends = (frames[np.concatenate((breaks - 1, [len(frames) - 1]))] + 1).tolist() if len(frames) > 0 else []
+        self.count = len(frames)
+    def __len__(self):
+        return self.count
+    def _find(self, frame):
+        #index of the last run starting at or before frame, -1 if none
+        return bisect_right(self.starts, frame) - 1
+    def __contains__(self, frame):
+        i = self._find(frame)
+        return i >= 0 and frame < self.ends[i]
+    def add(self, frame):
+        i = self._find(frame)
+        if i >= 0 and frame < self.ends[i]:
+            return
+        self.count += 1
+        join_left = i >= 0 and self.ends[i] == frame
+        join_right = i + 1 < len(self.starts) and self.starts[i + 1] == frame + 1
+        if join_left and join_right:
+            self.ends[i] = self.ends.pop(i + 1)
+            del self.starts[i + 1]
+        elif join_left:
+            self.ends[i] = frame + 1
+        elif join_right:
+            self.starts[i + 1] = frame
+        else:
+            self.starts.insert(i + 1, frame)
+            self.ends.insert(i + 1, frame + 1)
+    def remove(self, frame):
+        i = self._find(frame)
+        if i < 0 or frame >= self.ends[i]:
+            return
+        self.count -= 1
+        start, end = self.starts[i], self.ends[i]
+        if start == frame and end == frame + 1:
+            del self.starts[i], self.ends[i]
+        elif start == frame:
+            self.starts[i] = frame + 1
+        elif end == frame + 1:
+            self.ends[i] = frame
+        else:
+            self.ends[i] = frame
+            self.starts.insert(i + 1, frame + 1)
+            self.ends.insert(i + 1, end)
+    def next_unlabeled(self, frame):
+        '''
+        return the first unlabeled frame at or after frame
+        '''
+        i = self._find(frame)
+        if i >= 0 and frame < self.ends[i]:
+            return self.ends[i]
+        return frame
+    def prev_unlabeled(self, frame):
+        '''
+        return the last unlabeled frame at or before frame, -1 if there is none
+        '''
+        i = self._find(frame)
+        if i >= 0 and frame < self.ends[i]:
+            return self.starts[i] - 1
+        return frame
+    def count_in(self, start, end):
+        '''
+        return the number of labeled frames in [start, end)
+        '''
+        first, last = self._find(start), self._find(end - 1)
+        if last < 0 or end <= start:
+            return 0
+        first = max(first, 0)
+        count = sum(self.ends[i] - self.starts[i] for i in range(first, last + 1))
+        #clip the runs at both ends
+        count -= max(0, min(self.ends[first], start) - self.starts[first])
+        count -= max(0, self.ends[last] - max(self.starts[last], end))
+        return count
+    def gaps(self, start, end):
+        '''
+        return the unlabeled ranges [gap start, gap end) inside [start, end)
+        '''
+        gaps = []
+        frame = self.next_unlabeled(start)
+        i = self._find(frame) + 1
+        while frame < end:
+            gap_end = min(self.starts[i], end) if i < len(self.starts) else end
+            gaps.append((frame, gap_end))
+            if i >= len(self.starts):
+                break
+            frame = self.ends[i]
+            i += 1
+        return gaps
+
+
+class LabelStore:
+    '''
+    Labels of one video: preallocated (frames, 75, 3) points and a labeled mask, grown as needed.
+    The labeled frames are also indexed as runs, see FrameRuns
+    '''
+    def __init__(self, capacity=1024):
+        self.points = np.zeros((capacity, LABEL_JOINTS, LABEL_DIMS))
+        self.labeled = np.zeros(capacity, dtype=bool)
+        self.runs = FrameRuns()
+    def __len__(self):
+        return len(self.runs)
+    def _ensure_capacity(self, frame):
+        if frame < len(self.labeled):
+            return
+        capacity = max(frame + 1, 2 * len(self.labeled))
+        points = np.zeros((capacity, LABEL_JOINTS, LABEL_DIMS))
+        labeled = np.zeros(capacity, dtype=bool)
+        points[:len(self.points)] = self.points
+        labeled[:len(self.labeled)] = self.labeled
+        self.points, self.labeled = points, labeled
+    def is_labeled(self, frame):
+        return 0 <= frame < len(self.labeled) and bool(self.labeled[frame])
+    def get(self, frame):
+        '''
+        return a copy of the skeleton of a frame as [pose, right hand, left hand], or None if not labeled
+        '''
+        if not self.is_labeled(frame):
+            return None
+        return [self.points[frame, part].copy() for part in LABEL_PARTS]
+    def get_points(self, frame):
+        '''
+        return the (75, 3) points of a frame, or None if not labeled
+        '''
+        if not self.is_labeled(frame):
+            return None
+        return self.points[frame]
+    def set(self, frame, skeleton):
+        self._ensure_capacity(frame)
+        for part, points in zip(LABEL_PARTS, skeleton):
+            self.points[frame, part] = points
+        self.labeled[frame] = True
+        self.runs.add(frame)
+    def set_joints(self, frame, joints, points, labeled):
+        self._ensure_capacity(frame)
+        self.points[frame, joints] = points
+        self.labeled[frame] = labeled
+        if labeled:
+            self.runs.add(frame)
+        else:
+            self.points[frame] = 0
+            self.runs.remove(frame)
+    def set_points(self, frame, points):
+        self._ensure_capacity(frame)
+        self.points[frame] = points
+        self.labeled[frame] = True
+        self.runs.add(frame)
+    def remove(self, frame):
+        if self.is_labeled(frame):
+            self.labeled[frame] = False
+            self.points[frame] = 0
+            self.runs.remove(frame)
+    def frames(self):
+        '''
+        return the labeled frames in order
+        '''
+        return np.flatnonzero(self.labeled)
+    def to_arrays(self):
+        '''
+        return the labeled frames and their (n, 75, 3) points, as written to disk
+        '''
+        frames = self.frames()
+        return frames, self.points[frames]
+    @classmethod
+    def from_arrays(cls, frames, points):
+        store = cls(capacity=int(frames[-1]) + 1 if len(frames) > 0 else 1024)
+        store.points[frames] = points
+        store.labeled[frames] = True
+        store.runs = FrameRuns(np.unique(frames))
+        return store
+
+
+class UndoHistory:
+    '''
+    Undo/redo history of label changes, global across frames and videos.
+    A change only keeps the indices and the old and new coordinates of the joints it modified.
+    Changes are stored in fixed size ring buffers sized from a memory budget, the oldest are dropped when full.
+    '''
+    #bytes of one changed joint: index, old and new coordinates
+    JOINT_BYTES = 2 + 2 * LABEL_DIMS * 8
+    #bytes of one change: video, frame, first joint, joint count, labeled before and after
+    CHANGE_BYTES = 4 + 8 + 8 + 4 + 2
+
+    def __init__(self, budget_mb=64, joints_per_change=8):
+        '''
+        budget_mb: memory of the buffers in MB
+        joints_per_change: expected average joints per change, splits the budget between changes and joints
+        '''
+        budget = int(budget_mb * 1024 * 1024)
+        changes = max(16, budget // (self.CHANGE_BYTES + joints_per_change * self.JOINT_BYTES))
+        joints = max(LABEL_JOINTS, (budget - changes * self.CHANGE_BYTES) // self.JOINT_BYTES)
+        self.joint_index = np.zeros(joints, dtype=np.int16)
+        self.old = np.zeros((joints, LABEL_DIMS))
+        self.new = np.zeros((joints, LABEL_DIMS))
+        self.video = np.zeros(changes, dtype=np.int32)
+        self.frame = np.zeros(changes, dtype=np.int64)
+        self.start = np.zeros(changes, dtype=np.int64)
+        self.count = np.zeros(changes, dtype=np.int32)
+        self.was_labeled = np.zeros(changes, dtype=bool)
+        self.labeled = np.zeros(changes, dtype=bool)
+        self._videos = []
+        self._video_ids = {}
+        self.clear()
+    def __len__(self):
+        return self._end - self._first
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.joint_index, self.old, self.new, self.video, self.frame,
+                                      self.start, self.count, self.was_labeled, self.labeled))
+    def clear(self):
+        #changes are numbered from the start of the session, change i is stored at i % capacity
+        #[_first, _pointer) can be undone, [_pointer, _end) can be redone
+        self._first = 0
+        self._pointer = 0
+        self._end = 0
+        #next free joint slot, joint slots are numbered the same way
+        self._joint_end = 0
+    def can_undo(self):
+        return self._pointer > self._first
+    def can_redo(self):
+        return self._pointer < self._end
+    def push(self, video, frame, joints, old, new, was_labeled, labeled):
+        '''
+        record a change, dropping the changes that could be redone
+        '''
+        joint_capacity = len(self.joint_index)
+        if len(joints) > joint_capacity:
+            self.clear()
+            return
+        if self._pointer < self._end:
+            self._joint_end = int(self.start[self._pointer % len(self.video)])
+            self._end = self._pointer
+        #drop the oldest changes until both buffers have room
+        while self._first < self._end and (self._end - self._first >= len(self.video) or
+                                           self._joint_end + len(joints) - self.start[self._first % len(self.video)] > joint_capacity):
+            self._first += 1
+        if video not in self._video_ids:
+            self._video_ids[video] = len(self._videos)
+            self._videos.append(video)
+        i = self._end % len(self.video)
+        self.video[i] = self._video_ids[video]
+        self.frame[i] = frame
+        self.start[i] = self._joint_end
+        self.count[i] = len(joints)
+        self.was_labeled[i] = was_labeled
+        self.labeled[i] = labeled
+        slots = (self._joint_end + np.arange(len(joints))) % joint_capacity
+        self.joint_index[slots] = joints
+        self.old[slots] = old
+        self.new[slots] = new
+        self._joint_end += len(joints)
+        self._end += 1
+        self._pointer = self._end
+    def undo(self):
+        '''
+        return the last change as (video, frame, joints, old, new, was_labeled, labeled) and step back, or None
+        '''
+        if not self.can_undo():
+            return None
+        self._pointer -= 1
+        return self._get(self._pointer)
+    def redo(self):
+        '''
+        return the next undone change and step forward, or None
+        '''
+        if not self.can_redo():
+            return None
+        self._pointer += 1
+        return self._get(self._pointer - 1)
+    def _get(self, change):
+        i = change % len(self.video)
+        slots = (self.start[i] + np.arange(self.count[i])) % len(self.joint_index)
+        return (self._videos[self.video[i]], int(self.frame[i]), self.joint_index[slots].astype(np.intp),
+                self.old[slots], self.new[slots], bool(self.was_labeled[i]), bool(self.labeled[i]))
+
+
+class Outputdata:
+    '''
+    For all operations, the output data should be stored in this class:
+    Video > frame > pose/hand
+
+    Save, load, querry
+    Undo, redo of every change of the session, in any frame or video, within history_mb of memory
+
+    Saving writes the whole file, readable on its own. Saving without compacting to a file that was already
+    saved or loaded in this session only appends the edits made since to a journal next to it (<file>.journal),
+    which is folded into the file every compact_every records.
+    '''
+    def __init__(self, compact_every=2000, history_mb=64) -> None:
+        self.data = {}
+        self.history = UndoHistory(history_mb)
+        self.compact_every = compact_every
+        #sequence number of the last edit of each (video, frame)
+        self._edit_seq = 0
+        self._edits = {}
+        #path -> (last saved edit sequence, journal id, records in the journal)
+        self._saved = {}
+        self._listeners = []
+
+    def save(self, path, compact=True):
+        '''
+        compact: write the whole file and drop its journal, else only append the edits to the journal (autosave)
+        '''
+        state = self._saved.get(path)
+        if state is not None and os.path.isfile(path):
+            if not compact and state[2] < self.compact_every:
+                self._append_journal(path, state)
+                return
+            if state[2] == 0 and state[0] == self._edit_seq:
+                #the file is up to date and has no journal
+                return
+        self._write_base(path)
+
+    def load(self, path):
+        self.data = {}
+        self.history.clear()
+        with open(path, 'rb') as f:
+            content = pkl.load(f)
+        journal_id = None
+        if isinstance(content, dict) and content.get('format') == FILE_FORMAT:
+            journal_id = content['journal_id']
+            self.set_arrays(content['videos'])
+        else:
+            for video in content:
+                self.data[video] = LabelStore()
+                for frame in content[video]:
+                    self.data[video].set(frame, content[video][frame])
+        records = self._replay_journal(path, journal_id) if journal_id is not None else None
+        self._edits = {}
+        self._saved = {path: (self._edit_seq, journal_id, records)} if records is not None else {}
+        self._notify(None, None)
+
+    def add_listener(self, callback):
+        '''
+        call callback(video, frame) after every change of the labels of a frame, both are None when all labels were replaced
+        '''
+        self._listeners.append(callback)
+
+    def _notify(self, video, frame):
+        for callback in self._listeners:
+            callback(video, frame)
+
+    def _record_edit(self, video, frame):
+        self._edit_seq += 1
+        self._edits[(video, frame)] = self._edit_seq
+        self._notify(video, frame)
+
+    def _apply(self, video, frame, points):
+        if video not in self.data:
+            self.data[video] = LabelStore()
+        if points is None:
+            self.data[video].remove(frame)
+        else:
+            self.data[video].set_points(frame, points)
+
+    def get_edit_seq(self):
+        '''
+        return the sequence number of the last edit, it only grows
+        '''
+        return self._edit_seq
+
+    def get_edits_since(self, seq):
+        '''
+        return the frames edited after edit sequence seq, as a list of (video, frame, points copy or None if removed)
+        '''
+        edits = []
+        for (video, frame), edit_seq in self._edits.items():
+            if edit_seq > seq:
+                points = self.data[video].get_points(frame) if video in self.data else None
+                edits.append((video, frame, None if points is None else points.copy()))
+        return edits
+
+    def apply_edits(self, edits):
+        '''
+        apply edits returned by get_edits_since, they are recorded as edits of this instance (no undo history)
+        '''
+        for video, frame, points in edits:
+            self._apply(video, frame, points)
+            self._record_edit(video, frame)
+
+    def get_arrays(self):
+        '''
+        return a copy of all labels as {video: (labeled frames, (n, 75, 3) points)}
+        '''
+        return {video: self.data[video].to_arrays() for video in self.data}
+
+    def set_arrays(self, videos):
+        '''
+        replace all labels by the {video: (labeled frames, points)} returned by get_arrays
+        '''
+        self.data = {video: LabelStore.from_arrays(frames, points) for video, (frames, points) in videos.items()}
+        self._edits = {}
+        self._saved = {}
+        self._notify(None, None)
+
+    def _write_base(self, path):
+        #write then rename, an interrupted save never leaves a truncated file behind
+        journal_id = uuid.uuid4().hex
+        content = {'format': FILE_FORMAT, 'version': FILE_VERSION, 'journal_id': journal_id,
+                   'videos': self.get_arrays()}
+        with open(path + '.tmp', 'wb') as f:
+            pkl.dump(content, f, protocol=pkl.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        #the old journal belongs to the replaced file, its id no longer matches
+        if os.path.isfile(path + JOURNAL_SUFFIX):
+            os.remove(path + JOURNAL_SUFFIX)
+        self._saved[path] = (self._edit_seq, journal_id, 0)
+
+    def _append_journal(self, path, state):
+        saved_seq, journal_id, records = state
+        changed = [key for key, seq in self._edits.items() if seq > saved_seq]
+        if len(changed) == 0:
+            return
+        new_journal = not os.path.isfile(path + JOURNAL_SUFFIX)
+        with open(path + JOURNAL_SUFFIX, 'ab') as f:
+            if new_journal:
+                pkl.dump({'journal_id': journal_id}, f)
+            for video, frame in changed:
+                store = self.data.get(video)
+                points = store.get_points(frame) if store is not None else None
+                pkl.dump((video, frame, points), f, protocol=pkl.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self._saved[path] = (self._edit_seq, journal_id, records + len(changed))
+
+    def _replay_journal(self, path, journal_id):
+        #return the number of records replayed, or None if the journal can not be appended to
+        if not os.path.isfile(path + JOURNAL_SUFFIX):
+            return 0
+        records = 0
+        with open(path + JOURNAL_SUFFIX, 'rb') as f:
+            try:
+                header = pkl.load(f)
+            except Exception:
+                header = None
+            if not isinstance(header, dict) or header.get('journal_id') != journal_id:
+                #a journal of another file, or cut in its header: the next save rewrites the file and drops it
+                return None
+            #offset after the last complete record
+            good = f.tell()
+            while True:
+                try:
+                    video, frame, points = pkl.load(f)
+                except Exception:
+                    #end of the journal, or a record cut by a crash (garbage may raise anything)
+                    break
+                self._apply(video, frame, points)
+                records += 1
+                good = f.tell()
+            size = os.fstat(f.fileno()).st_size
+        if good < size:
+            #never append after a cut record, the records appended later would be unreadable
+            try:
+                os.truncate(path + JOURNAL_SUFFIX, good)
+            except OSError:
+                return None
+        return records
+
+    def get_skeleton(self, video, frame):
+        if video not in self.data:
+            return None
+        return self.data[video].get(frame)
+
+
+    def add_skeleton(self, video, frame, skeleton):
+        if video not in self.data:
+            self.data[video] = LabelStore()
+        points = np.zeros((LABEL_JOINTS, LABEL_DIMS))
+        for part, _points in zip(LABEL_PARTS, skeleton):
+            points[part] = _points
+        self._change(video, frame, points, True)
+
+    def remove_skeleton(self, video, frame):
+        if video not in self.data or not self.data[video].is_labeled(frame):
+            return
+        self._change(video, frame, np.zeros((LABEL_JOINTS, LABEL_DIMS)), False)
+
+    def _change(self, video, frame, points, labeled):
+        #record only the joints that change in the history, then apply them
+        store = self.data[video]
+        was_labeled = store.is_labeled(frame)
+        old = store.points[frame] if was_labeled else np.zeros((LABEL_JOINTS, LABEL_DIMS))
+        joints = np.flatnonzero((old != points).any(axis=1))
+        if len(joints) == 0 and labeled == was_labeled:
+            #e.g. saving a labeled frame again while recording, nothing to undo, journal or autosave
+            return
+        self.history.push(video, frame, joints, old[joints], points[joints], was_labeled, labeled)
+        self._set_joints(video, frame, joints, points[joints], labeled)
+
+    def _set_joints(self, video, frame, joints, points, labeled):
+        if video not in self.data:
+            self.data[video] = LabelStore()
+        self.data[video].set_joints(frame, joints, points, labeled)
+        self._record_edit(video, frame)
+
+    def undo_action(self):
+        '''
+        revert the last change of any frame of any video, return its (video, frame) or None if there is nothing to undo
+        '''
+        change = self.history.undo()
+        if change is None:
+            return None
+        video, frame, joints, old, new, was_labeled, labeled = change
+        self._set_joints(video, frame, joints, old, was_labeled)
+        return video, frame
+
+    def redo_action(self):
+        '''
+        apply again the last undone change, return its (video, frame) or None if there is nothing to redo
+        '''
+        change = self.history.redo()
+        if change is None:
+            return None
+        video, frame, joints, old, new, was_labeled, labeled = change
+        self._set_joints(video, frame, joints, new, labeled)
+        return video, frame
+
+    def get_undo_redo_status(self):
+        #return if can undo, redo
+        return self.history.can_undo(), self.history.can_redo()
+    def is_labeled(self, video, frame):
+        return video in self.data and self.data[video].is_labeled(frame)
+
+    def get_labeled_count(self, video, start=0, end=None):
+        '''
+        return the number of labeled frames of a video, in [start, end) if end is given
+        '''
+        if video not in self.data:
+            return 0
+        if end is None and start == 0:
+            return len(self.data[video])
+        return self.data[video].runs.count_in(start, end if end is not None else len(self.data[video].labeled))
+
+    def get_next_unlabeled(self, video, frame, end):
+        '''
+        return the first unlabeled frame after frame and before end, or None
+        '''
+        if video not in self.data:
+            return frame + 1 if frame + 1 < end else None
+        next_frame = self.data[video].runs.next_unlabeled(frame + 1)
+        return next_frame if next_frame < end else None
+
+    def get_prev_unlabeled(self, video, frame):
+        '''
+        return the last unlabeled frame before frame, or None
+        '''
+        if video not in self.data:
+            return frame - 1 if frame > 0 else None
+        prev_frame = self.data[video].runs.prev_unlabeled(frame - 1)
+        return prev_frame if prev_frame >= 0 else None
+
+    def get_unlabeled_ranges(self, video, start, end):
+        '''
+        return the unlabeled ranges [gap start, gap end) of a video inside [start, end)
+        '''
+        if video not in self.data:
+            return [(start, end)] if start < end else []
+        return self.data[video].runs.gaps(start, end)
+
+    def get_all_labeled_frames(self, video):
+        #check if video exists
+        if video not in self.data:
+            return 0,[]
+        else:
+            #return the number of labeled frames and a list of labeled frames
+            return len(self.data[video]), self.data[video].frames().tolist()
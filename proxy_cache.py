@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import argparse
+import threading
+import cv2
+import dataset as ds
+
+#proxies are all intra MJPEG: every frame is a keyframe, so any frame is one decode away
+PROXY_FOURCC = 'MJPG'
+PROXY_SUFFIX = '.avi'
+#proxies are downscaled to at most this height, never upscaled
+PROXY_HEIGHT = 720
+PROXY_QUALITY = 90
+#unfinished proxies older than this were left by a process that stopped, not by a running build
+STALE_SECONDS = 3600
+
+
+def proxy_path(cache_dir, video_path, max_height=PROXY_HEIGHT):
+    '''
+    return the path of the proxy of a video in the proxies folder of a cache folder
+    '''
+    #keyed on the source file and the proxy settings, a changed source gets a new proxy
+    return os.path.join(cache_dir, 'proxies', ds.source_key(video_path, max_height) + PROXY_SUFFIX)
+
+def proxy_size(width, height, max_height=PROXY_HEIGHT):
+    '''
+    return the (width, height) of the proxy of a width x height video, even for the encoder
+    '''
+    if height <= max_height:
+        return width - width % 2, height - height % 2
+    width = round(width * max_height / height)
+    return width - width % 2, max_height - max_height % 2
+
+def remove_stale(folder):
+    '''
+    remove the unfinished proxies of a proxies folder that are not being written anymore
+    '''
+    now = time.time()
+    for name in os.listdir(folder):
+        if name.endswith('.tmp' + PROXY_SUFFIX):
+            try:
+                if now - os.path.getmtime(os.path.join(folder, name)) > STALE_SECONDS:
+                    os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+def build_proxy(video_path, path, max_height=PROXY_HEIGHT, quality=PROXY_QUALITY, stop=None):
+    '''
+    transcode a video into an MJPEG proxy at path, return the number of frames written,
+    or None if stopped (stop: optional threading.Event). The proxy is written then renamed,
+    so an existing proxy is always complete
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    remove_stale(os.path.dirname(path))
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise Exception(f'Can not open {video_path}')
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    size = proxy_size(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), max_height)
+    tmp_path = path[:-len(PROXY_SUFFIX)] + '.tmp' + PROXY_SUFFIX
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*PROXY_FOURCC), fps, size)
+    if not writer.isOpened():
+        capture.release()
+        raise Exception(f'Can not write {tmp_path}')
+    writer.set(cv2.VIDEOWRITER_PROP_QUALITY, quality)
+    frames = 0
+    image = None
+    resized = None
+    try:
+        while stop is None or not stop.is_set():
+            success, image = capture.read(image)
+            if not success:
+                break
+            resized = cv2.resize(image, size, dst=resized, interpolation=cv2.INTER_AREA)
+            writer.write(resized)
+            frames += 1
+    finally:
+        writer.release()
+        capture.release()
+    if (stop is not None and stop.is_set()) or frames == 0:
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, path)
+    return frames
+
+def open_proxy(path):
+    '''
+    return an opened cv2.VideoCapture of a proxy, or None if there is no usable proxy at path
+    '''
+    if not os.path.isfile(path):
+        return None
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened() or int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) <= 0:
+        capture.release()
+        return None
+    return capture
+
+
+class ProxyBuilder:
+    '''
+    Build proxies one after the other on a background thread, see build_proxy
+    '''
+    def __init__(self, max_height=PROXY_HEIGHT, quality=PROXY_QUALITY):
+        self.max_height = max_height
+        self.quality = quality
+        #paths of the proxies built so far, and of the failed ones with their error
+        self.built = set()
+        self.failed = {}
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def request(self, video_path, path):
+        '''
+        queue the proxy of a video, unless it is already queued, built or failed
+        '''
+        with self._lock:
+            if path in self._pending or path in self.built or path in self.failed:
+                return
+            self._pending.add(path)
+        self._queue.put((video_path, path))
+    def is_built(self, path):
+        with self._lock:
+            return path in self.built
+    def stop(self):
+        '''
+        stop building, the proxy being built is discarded
+        '''
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join()
+    def _run(self):
+        while not self._stop.is_set():
+            task = self._queue.get()
+            if task is None:
+                break
+            video_path, path = task
+            try:
+                frames = build_proxy(video_path, path, self.max_height, self.quality, self._stop)
+                error = None
+            except Exception as e:
+                frames, error = None, e
+            with self._lock:
+                self._pending.discard(path)
+                if frames is not None:
+                    self.built.add(path)
+                elif error is not None:
+                    self.failed[path] = error
+
+
+def _proxy_video(video_path, cache_dir, max_height, quality, force):
+    path = proxy_path(cache_dir, video_path, max_height)
+    if not force and os.path.isfile(path):
+        return None
+    return build_proxy(video_path, path, max_height, quality)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the low resolution all intra proxy of every video in metadata.json')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of videos transcoded in parallel')
+    parser.add_argument('--cache-dir', default=None, help='cache folder of the editor (default: .hple_cache in the data folder)')
+    parser.add_argument('--height', type=int, default=PROXY_HEIGHT, help='maximum height of the proxies')
+    parser.add_argument('--quality', type=int, default=PROXY_QUALITY, help='JPEG quality of the proxies, 0 to 100')
+    parser.add_argument('--force', action='store_true', help='rebuild existing proxies')
+    args = parser.parse_args()
+
+    metadata = ds.load_metadata(args.data_path)
+    cache_dir = ds.get_cache_dir(args.data_path, args.cache_dir)
+    tasks = {video: (os.path.join(args.data_path, metadata[video]['local_path']), cache_dir, args.height, args.quality, args.force) for video in metadata}
+    ds.run_tasks(_proxy_video, tasks, lambda frames: 'proxy exists' if frames is None else f'{frames} frames', args.jobs)
@@ -0,0 +1,65 @@
+import warnings
+import numpy as np
+
+#how much each metric counts in the review score, see review_scores
+REVIEW_WEIGHTS = {'disagreement': 1.0, 'confidence': 1.0, 'jitter': 0.5}
+
+
+def _normalized(values):
+    #scale by the median so metrics of different units are comparable, undefined values count as 0
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        scale = np.nanmedian(values) if np.isfinite(values).any() else 0.0
+    if not scale > 0:
+        scale = 1.0
+    return np.nan_to_num(values / scale, nan=0.0)
+
+def review_scores(video_metrics, weights=None):
+    '''
+    return the review score of every frame from a metrics.VideoMetrics, higher means more in need of review:
+    disagreement between the methods, low confidence and jitter (temporal discontinuity), each averaged over
+    the methods and normalized by its median over the video
+    '''
+    weights = REVIEW_WEIGHTS if weights is None else weights
+    scores = np.zeros(len(video_metrics), dtype=np.float64)
+    with warnings.catch_warnings():
+        #frames no method detected anything in are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for metric, weight in weights.items():
+            values = np.nanmean(video_metrics.get_track(metric), axis=1)
+            if metric == 'confidence':
+                values = 1.0 - values
+            scores += weight * _normalized(values)
+    return scores
+
+
+class ReviewQueue:
+    '''
+    Frames of a video from the worst to the best review score, walked with next_frame.
+    Frames already labeled are skipped when they come up, so labeling while reviewing just moves on
+    '''
+    def __init__(self, scores):
+        self.scores = np.asarray(scores)
+        #stable, so frames with equal scores come in frame order
+        self.order = np.argsort(-self.scores, kind='stable')
+        self.position = 0
+    def __len__(self):
+        return len(self.order)
+    def reset(self):
+        self.position = 0
+    def next_frame(self, is_labeled=None):
+        '''
+        return the next worst frame that is not labeled, or None when every frame was visited.
+        is_labeled: function of a frame, default: no frame is labeled
+        '''
+        while self.position < len(self.order):
+            frame = int(self.order[self.position])
+            self.position += 1
+            if is_labeled is None or not is_labeled(frame):
+                return frame
+        return None
+    def rank(self, frame):
+        '''
+        return the rank of a frame, 0 is the worst
+        '''
+        return int(np.flatnonzero(self.order == frame)[0])
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+
+class VideoSession:
+    '''
+    Everything DataHandler opened or loaded for one video: the frame provider (capture handle and frame cache),
+    the keyframe index, the loaded methods and the proxy. Kept in a SessionPool while another video is current
+    '''
+    def __init__(self, video, frame_provider, keyframe_index, total_frame, width, height, fps, skeleton_data,
+                 proxy_path=None, proxy_provider=None, proxy_frames=0, current_frame=0):
+        self.video = video
+        self.frame_provider = frame_provider
+        self.keyframe_index = keyframe_index
+        self.total_frame = total_frame
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.skeleton_data = skeleton_data
+        self.proxy_path = proxy_path
+        self.proxy_provider = proxy_provider
+        self.proxy_frames = proxy_frames
+        self.current_frame = current_frame
+    def nbytes(self):
+        '''
+        return the memory held by the session: decoded frames and methods loaded in memory (mapped methods are paged by the OS)
+        '''
+        total = self.frame_provider.nbytes()
+        if self.proxy_provider is not None:
+            total += self.proxy_provider.nbytes()
+        return total + sum(data.nbytes() for data in self.skeleton_data.values() if not data.is_mapped())
+    def clear_frames(self):
+        '''
+        drop the decoded frames, the handles stay open
+        '''
+        self.frame_provider.clear()
+        if self.proxy_provider is not None:
+            self.proxy_provider.clear()
+    def release(self):
+        self.frame_provider.release()
+        if self.proxy_provider is not None:
+            self.proxy_provider.release()
+        self.skeleton_data.clear()
+
+
+class SessionPool:
+    '''
+    The sessions of the most recently used videos, so switching back to one of them reopens nothing.
+    Bounded by a number of videos and by the memory the sessions hold: over the memory budget, the decoded frames
+    of the least recently used sessions are dropped first, then whole sessions
+    '''
+    def __init__(self, max_videos=4, max_mb=1024):
+        '''
+        max_videos: maximum number of sessions kept, besides the current video
+        max_mb: maximum memory held by the kept sessions in MB (None for no limit)
+        '''
+        self.max_videos = max_videos
+        self.max_bytes = None if max_mb is None else int(max_mb * 1024 * 1024)
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def __len__(self):
+        return len(self._sessions)
+    def __contains__(self, video):
+        return video in self._sessions
+    def nbytes(self):
+        return sum(session.nbytes() for session in self._sessions.values())
+    def take(self, video):
+        '''
+        remove and return the session of a video, or None if it is not kept
+        '''
+        session = self._sessions.pop(video, None)
+        if session is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return session
+    def put(self, session):
+        '''
+        keep the session of a video that is no longer current, releasing the least recently used sessions beyond the bounds
+        '''
+        old = self._sessions.pop(session.video, None)
+        if old is not None and old is not session:
+            old.release()
+        self._sessions[session.video] = session
+        while len(self._sessions) > self.max_videos:
+            self._sessions.popitem(last=False)[1].release()
+        if self.max_bytes is None:
+            return
+        #cheap to rebuild first: decoded frames, from the least recently used session
+        for kept in self._sessions.values():
+            if self.nbytes() <= self.max_bytes:
+                return
+            kept.clear_frames()
+        while len(self._sessions) > 0 and self.nbytes() > self.max_bytes:
+            self._sessions.popitem(last=False)[1].release()
+    def clear(self):
+        for session in self._sessions.values():
+            session.release()
+        self._sessions.clear()
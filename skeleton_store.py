@@ -0,0 +1,277 @@
+import os
+import json
+import argparse
+import pickle as pkl
+import numpy as np
+import dataset as ds
+
+POSE_JOINTS = 33
+HAND_JOINTS = 21
+#slot of each hand class in the hands arrays
+HAND_CLASSES = ['Right', 'Left']
+#whole skeleton joint layout: 33 pose joints, then 21 joints of each hand in HAND_CLASSES order
+JOINTS = POSE_JOINTS + len(HAND_CLASSES) * HAND_JOINTS
+JOINT_DIMS = 4
+POSE_SLICE = slice(0, POSE_JOINTS)
+HAND_SLICES = [slice(POSE_JOINTS + i * HAND_JOINTS, POSE_JOINTS + (i + 1) * HAND_JOINTS) for i in range(len(HAND_CLASSES))]
+
+#converted method files are stored next to the source: <method file name>.lmkb
+BINARY_SUFFIX = '.lmkb'
+NPZ_SUFFIX = '.npz'
+#.lmkb layout: magic, little endian uint64 header length, json header, arrays aligned to ALIGNMENT bytes
+BINARY_MAGIC = b'HPLMKB1\0'
+ALIGNMENT = 64
+ARRAY_NAMES = ['pose', 'pose_present', 'hands', 'hand_scores', 'hand_present']
+
+
+class SkeletonArrays:
+    '''
+    Skeleton data of one method for a whole video, kept as contiguous arrays:
+    pose (frames, 33, pose_dims), pose_present (frames,),
+    hands (frames, 2, 21, hand_dims), hand_scores (frames, 2), hand_present (frames, 2).
+    Hand slot 0 is the Right hand and slot 1 the Left hand.
+    '''
+    def __init__(self, pose, pose_present, hands, hand_scores, hand_present):
+        self.pose = pose
+        self.pose_present = pose_present
+        self.hands = hands
+        self.hand_scores = hand_scores
+        self.hand_present = hand_present
+        for array in self.arrays().values():
+            array.flags.writeable = False
+    def __len__(self):
+        return len(self.pose)
+    def arrays(self):
+        return {'pose': self.pose, 'pose_present': self.pose_present, 'hands': self.hands,
+                'hand_scores': self.hand_scores, 'hand_present': self.hand_present}
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays().values())
+    def is_mapped(self):
+        '''
+        return True if the arrays are memory mapped from a .lmkb file instead of held in memory
+        '''
+        return isinstance(self.pose, np.memmap)
+    def get_frame(self, frame):
+        '''
+        return pose, hand of a frame in the layout of the method files, the arrays are read only views:
+        pose is (33, pose_dims), or empty if not detected,
+        hand is a dict of {'class', 'landmarks', 'score'} for each detected hand
+        '''
+        pose = self.pose[frame] if self.pose_present[frame] else self.pose[frame, :0]
+        hand = {}
+        for slot, hand_class in enumerate(HAND_CLASSES):
+            if self.hand_present[frame, slot]:
+                hand[str(len(hand))] = {'class': hand_class,
+                                        'landmarks': self.hands[frame, slot],
+                                        'score': float(self.hand_scores[frame, slot])}
+        return pose, hand
+
+    def get_joints(self, frames=slice(None)):
+        '''
+        return the whole skeleton of frames as points (..., 75, 4) and per joint scores (..., 75):
+        pose visibility for the pose joints, the hand score for the hand joints. Missing joints are zero
+        '''
+        pose = np.asarray(self.pose[frames])
+        hands = np.asarray(self.hands[frames])
+        points = np.zeros(pose.shape[:-2] + (JOINTS, JOINT_DIMS), dtype=np.float32)
+        points[..., POSE_SLICE, :pose.shape[-1]] = pose[..., :JOINT_DIMS]
+        scores = np.zeros(pose.shape[:-2] + (JOINTS,), dtype=np.float32)
+        if pose.shape[-1] > 3:
+            scores[..., POSE_SLICE] = pose[..., 3]
+        else:
+            scores[..., POSE_SLICE] = np.asarray(self.pose_present[frames])[..., None]
+        hand_scores = np.asarray(self.hand_scores[frames])
+        for slot, hand_slice in enumerate(HAND_SLICES):
+            points[..., hand_slice, :hands.shape[-1]] = hands[..., slot, :, :JOINT_DIMS]
+            scores[..., hand_slice] = hand_scores[..., slot, None]
+        return points, scores
+
+    @classmethod
+    def from_nested(cls, data):
+        '''
+        convert the nested lists and dicts of a .json/.lmks method file
+        '''
+        poses = data['pose']
+        frames_hands = data['hands']
+        frames = len(poses)
+        pose_dims = next((len(pose[0]) for pose in poses if len(pose) > 0), 4)
+        hand_dims = next((len(h['landmarks'][0]) for hands in frames_hands for h in _hand_list(hands) if len(h['landmarks']) > 0), 3)
+
+        pose = np.zeros((frames, POSE_JOINTS, pose_dims), dtype=np.float32)
+        pose_present = np.zeros(frames, dtype=bool)
+        hands = np.zeros((frames, len(HAND_CLASSES), HAND_JOINTS, hand_dims), dtype=np.float32)
+        hand_scores = np.zeros((frames, len(HAND_CLASSES)), dtype=np.float32)
+        hand_present = np.zeros((frames, len(HAND_CLASSES)), dtype=bool)
+        for frame in range(frames):
+            if len(poses[frame]) > 0:
+                points = np.asarray(poses[frame], dtype=np.float32)[:POSE_JOINTS, :pose_dims]
+                pose[frame, :len(points), :points.shape[1]] = points
+                pose_present[frame] = True
+            for h in _hand_list(frames_hands[frame]):
+                slot = HAND_CLASSES.index(h['class'])
+                #keep the most confident hand if a class is detected twice
+                if hand_present[frame, slot] and hand_scores[frame, slot] >= h['score']:
+                    continue
+                points = np.asarray(h['landmarks'], dtype=np.float32)[:HAND_JOINTS, :hand_dims]
+                hands[frame, slot] = 0
+                hands[frame, slot, :len(points), :points.shape[1]] = points
+                hand_scores[frame, slot] = h['score']
+                hand_present[frame, slot] = True
+        return cls(pose, pose_present, hands, hand_scores, hand_present)
+
+    def save_npz(self, path, source_path=None):
+        '''
+        save the arrays, source_path ties the file to the method file it was converted from
+        '''
+        source = np.array(ds.source_stamp(source_path) if source_path is not None else [0, 0], dtype=np.int64)
+        with open(path, 'wb') as f:
+            np.savez(f, source=source, **self.arrays())
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as data:
+            return cls(*[data[key] for key in ARRAY_NAMES])
+
+    def save_binary(self, path, source_path=None):
+        '''
+        save the arrays in the .lmkb format, which open_binary maps without reading it
+        '''
+        arrays = self.arrays()
+        header = {'source': ds.source_stamp(source_path) if source_path is not None else [0, 0], 'arrays': {}}
+        #offsets depend on the header length, so lay the arrays out after a generously padded header
+        header_size = ALIGNMENT * 64
+        offset = header_size
+        for name in ARRAY_NAMES:
+            header['arrays'][name] = {'dtype': arrays[name].dtype.str, 'shape': list(arrays[name].shape), 'offset': offset}
+            offset += -(-arrays[name].nbytes // ALIGNMENT) * ALIGNMENT
+        header_bytes = json.dumps(header).encode('utf-8')
+        assert len(BINARY_MAGIC) + 8 + len(header_bytes) <= header_size, 'Header too large'
+        with open(path, 'wb') as f:
+            f.write(BINARY_MAGIC)
+            f.write(np.array(len(header_bytes), dtype='<u8').tobytes())
+            f.write(header_bytes)
+            for name in ARRAY_NAMES:
+                f.seek(header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(arrays[name]).tobytes())
+            f.truncate(offset)
+
+    @classmethod
+    def open_binary(cls, path):
+        '''
+        map a .lmkb file, frames are only read from disk when they are accessed
+        '''
+        header = _read_binary_header(path)
+        arrays = []
+        for name in ARRAY_NAMES:
+            info = header['arrays'][name]
+            shape = tuple(info['shape'])
+            if 0 in shape:
+                #np.memmap can not map empty arrays
+                arrays.append(np.zeros(shape, dtype=info['dtype']))
+            else:
+                arrays.append(np.memmap(path, dtype=info['dtype'], mode='r', offset=info['offset'], shape=shape))
+        return cls(*arrays)
+
+
+def skeleton_to_joints(pose, hand):
+    '''
+    convert pose, {'Right': landmarks, 'Left': landmarks} as used by the GUI to a (75, 4) joints array,
+    missing parts are zero
+    '''
+    points = np.zeros((JOINTS, JOINT_DIMS), dtype=np.float32)
+    pose = np.asarray(pose, dtype=np.float32)
+    if pose.size > 0:
+        pose = pose.reshape(len(pose), -1)[:POSE_JOINTS, :JOINT_DIMS]
+        points[:len(pose), :pose.shape[1]] = pose
+    for hand_class, hand_slice in zip(HAND_CLASSES, HAND_SLICES):
+        if hand_class in hand and len(hand[hand_class]) > 0:
+            landmarks = np.asarray(hand[hand_class], dtype=np.float32)[:HAND_JOINTS, :JOINT_DIMS]
+            points[hand_slice.start:hand_slice.start + len(landmarks), :landmarks.shape[1]] = landmarks
+    return points
+
+def joints_to_skeleton(points):
+    '''
+    convert a (75, dims) joints array to [pose, {'Right': landmarks, 'Left': landmarks}] lists as used by the GUI
+    '''
+    points = np.asarray(points)
+    return [points[POSE_SLICE].tolist(), {hand_class: points[hand_slice].tolist() for hand_class, hand_slice in zip(HAND_CLASSES, HAND_SLICES)}]
+
+def _hand_list(hands):
+    #hands of a frame are a dict keyed by index in .json files, a list in some .lmks files
+    return hands.values() if isinstance(hands, dict) else hands
+
+def load_nested(path):
+    '''
+    load a .json or .lmks method file as nested lists and dicts
+    '''
+    if '.json' in path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return pkl.load(f)
+
+def _read_binary_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f'Not a landmark binary file: {path}')
+        header_length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        return json.loads(f.read(header_length).decode('utf-8'))
+
+def converted_path(path):
+    return path + BINARY_SUFFIX
+
+def is_converted(path):
+    '''
+    return True if the method file has an up to date converted copy
+    '''
+    binary_path = converted_path(path)
+    if not os.path.isfile(binary_path):
+        return False
+    try:
+        return _read_binary_header(binary_path)['source'] == ds.source_stamp(path)
+    except (OSError, KeyError, ValueError):
+        return False
+
+def load_method_file(path, convert=False):
+    '''
+    load a method file as SkeletonArrays, memory mapped from its converted copy when it is up to date.
+    convert: write the converted copy of a .json/.lmks file that has none, so the next load is mapped
+    '''
+    if path.endswith(BINARY_SUFFIX):
+        return SkeletonArrays.open_binary(path)
+    if path.endswith(NPZ_SUFFIX):
+        return SkeletonArrays.load_npz(path)
+    if is_converted(path):
+        return SkeletonArrays.open_binary(converted_path(path))
+    arrays = SkeletonArrays.from_nested(load_nested(path))
+    if convert:
+        try:
+            arrays.save_binary(converted_path(path), path)
+        except OSError:
+            #read only dataset, keep the arrays in memory
+            pass
+    return arrays
+
+def convert_method_file(path, force=False):
+    '''
+    write the converted copy of a method file next to it, return the number of frames
+    '''
+    if not force and is_converted(path):
+        return None
+    arrays = SkeletonArrays.from_nested(load_nested(path))
+    arrays.save_binary(converted_path(path), path)
+    return len(arrays)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the method files of every video in metadata.json to arrays')
+    parser.add_argument('data_path', help='path to the data folder containing metadata.json')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of files converted in parallel')
+    parser.add_argument('--force', action='store_true', help='convert files that are already converted')
+    args = parser.parse_args()
+
+    metadata = ds.load_metadata(args.data_path)
+    files = sorted({os.path.join(args.data_path, metadata[video]['methods'][method]) for video in metadata for method in metadata[video]['methods']})
+    files = [path for path in files if not path.endswith((BINARY_SUFFIX, NPZ_SUFFIX))]
+    tasks = {os.path.relpath(path, args.data_path): (path, args.force) for path in files}
+    ds.run_tasks(convert_method_file, tasks, lambda frames: 'up to date' if frames is None else f'{frames} frames', args.jobs)
@@ -0,0 +1,181 @@
+import json
+import hashlib
+import numpy as np
+import consensus as cs
+import gap_fill as gf
+
+#temporal filters of landmark tracks, 'none' leaves the track as is
+FILTERS = ['none', 'one_euro', 'savgol', 'kalman']
+FILTER_NAMES = {'none': 'None', 'one_euro': 'One-Euro', 'savgol': 'Savitzky-Golay', 'kalman': 'Kalman'}
+#default parameters, coordinates are normalized to the frame size
+FILTER_PARAMS = {'none': {},
+                 'one_euro': {'min_cutoff': 2.0, 'beta': 10.0, 'd_cutoff': 1.0},
+                 'savgol': {'window': 9, 'order': 2},
+                 'kalman': {'process_noise': 1e-4, 'measurement_noise': 1e-4}}
+#only the coordinates are smoothed, the visibility/score dimension is kept
+SMOOTH_DIMS = 3
+
+
+class OneEuroFilter:
+    '''
+    Streaming One-Euro filter of a skeleton, one frame at a time: a low pass filter whose cutoff rises with the speed,
+    so slow movements are smoothed and fast ones follow with little lag. Every joint and dimension is filtered at once
+    '''
+    def __init__(self, fps=30, min_cutoff=2.0, beta=10.0, d_cutoff=1.0):
+        self.fps = fps
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+    def reset(self):
+        self._x = None
+        self._dx = None
+        self._started = None
+    def _alpha(self, cutoff):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau * self.fps)
+    def __call__(self, x, valid):
+        '''
+        x: (joints, dims) points of the next frame, valid: (joints,) mask of the detected joints.
+        return the filtered points, missing joints are zero and restart the filter when they come back
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        valid = np.asarray(valid, dtype=bool)[:, None]
+        if self._x is None:
+            self._x = x.copy()
+            self._dx = np.zeros_like(x)
+            self._started = np.zeros(valid.shape, dtype=bool)
+        started = self._started
+        dx = np.where(started, (x - self._x) * self.fps, 0.0)
+        a_d = self._alpha(self.d_cutoff)
+        dx = a_d * dx + (1 - a_d) * self._dx
+        a = self._alpha(self.min_cutoff + self.beta * np.abs(dx))
+        filtered = np.where(started, a * x + (1 - a) * self._x, x)
+        self._x = np.where(valid, filtered, 0.0)
+        self._dx = np.where(valid, dx, 0.0)
+        self._started = valid
+        return self._x.copy()
+
+
+class KalmanFilter:
+    '''
+    Streaming constant velocity Kalman filter of a skeleton, one frame at a time.
+    Every coordinate has its own position/velocity state, all of them are updated at once
+    '''
+    def __init__(self, process_noise=1e-4, measurement_noise=1e-4):
+        '''
+        process_noise: variance of the per frame acceleration
+        measurement_noise: variance of the detector jitter
+        '''
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+    def reset(self):
+        self._x = None
+    def __call__(self, x, valid):
+        '''
+        x: (joints, dims) points of the next frame, valid: (joints,) mask of the detected joints.
+        return the filtered points, missing joints are zero and restart the filter when they come back
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        valid = np.asarray(valid, dtype=bool)[:, None]
+        if self._x is None:
+            self._x = x.copy()
+            self._v = np.zeros_like(x)
+            #covariance [[p00, p01], [p01, p11]] of each coordinate
+            self._p00 = np.full_like(x, self.r)
+            self._p01 = np.zeros_like(x)
+            self._p11 = np.full_like(x, self.r)
+            self._started = np.zeros(valid.shape, dtype=bool)
+        q, r = self.q, self.r
+        #predict, dt is one frame
+        x_pred = self._x + self._v
+        p00 = self._p00 + 2 * self._p01 + self._p11 + q / 4
+        p01 = self._p01 + self._p11 + q / 2
+        p11 = self._p11 + q
+        #update with the measurement
+        gain0 = p00 / (p00 + r)
+        gain1 = p01 / (p00 + r)
+        residual = x - x_pred
+        started = self._started
+        self._x = np.where(started, x_pred + gain0 * residual, x)
+        self._v = np.where(started, self._v + gain1 * residual, 0.0)
+        self._p00 = np.where(started, (1 - gain0) * p00, r)
+        self._p01 = np.where(started, (1 - gain0) * p01, 0.0)
+        self._p11 = np.where(started, p11 - gain1 * p01, r)
+        self._x = np.where(valid, self._x, 0.0)
+        self._started = valid
+        return self._x.copy()
+
+
+def savgol_coefficients(window, order):
+    '''
+    return the Savitzky-Golay smoothing coefficients: the value at the center of a least squares
+    polynomial fit of the given order over a window of frames
+    '''
+    assert window % 2 == 1 and window > order, 'window must be odd and larger than order'
+    half = window // 2
+    vandermonde = np.vander(np.arange(-half, half + 1), order + 1, increasing=True)
+    return np.linalg.pinv(vandermonde)[0]
+
+def savgol_track(points, window=9, order=2):
+    '''
+    smooth a (frames, ...) track with a Savitzky-Golay filter along the frames, edges are padded with the edge values
+    '''
+    coefficients = savgol_coefficients(window, order)
+    half = window // 2
+    padded = np.pad(points, [(half, half)] + [(0, 0)] * (points.ndim - 1), mode='edge')
+    result = np.zeros(points.shape, dtype=np.float64)
+    for k, c in enumerate(coefficients):
+        result += c * padded[k:k + len(points)]
+    return result
+
+def smooth_track(points, filter_name='one_euro', fps=30, **params):
+    '''
+    smooth a whole (frames, joints, dims) track, missing (zero) joints stay missing.
+    filter_name: one of FILTERS, params override FILTER_PARAMS[filter_name]
+    '''
+    assert filter_name in FILTERS, f'Unknown filter: {filter_name}'
+    points = np.asarray(points)
+    result = np.array(points, dtype=np.float32)
+    if filter_name == 'none' or len(points) == 0:
+        return result
+    params = dict(FILTER_PARAMS[filter_name], **params)
+    valid = gf.joint_valid(points)
+    coords = np.asarray(points[..., :SMOOTH_DIMS], dtype=np.float64)
+    if filter_name == 'savgol':
+        #gaps are bridged before filtering so the window never averages in zeros
+        filled, _ = gf.fill_gaps(coords, valid)
+        result[..., :SMOOTH_DIMS] = np.where(valid[..., None], savgol_track(filled, **params), 0.0)
+        return result
+    stream = OneEuroFilter(fps, **params) if filter_name == 'one_euro' else KalmanFilter(**params)
+    for frame in range(len(points)):
+        result[frame, :, :SMOOTH_DIMS] = stream(coords[frame], valid[frame])
+    return result
+
+def smoothing_key(source_key, filter_name, params, fps):
+    return hashlib.sha1(json.dumps({'source': source_key, 'filter': filter_name, 'params': params, 'fps': fps}, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_smoothed_consensus(handler, methods, mode='mean', trim=0.25, filter_name='one_euro', **params):
+    '''
+    return the smoothed whole video consensus of methods, cached per video, method files, mode and filter parameters
+    '''
+    track = cs.get_video_consensus(handler, methods, mode, trim)
+    if filter_name == 'none':
+        return track
+    params = dict(FILTER_PARAMS[filter_name], **params)
+    key = smoothing_key(cs.video_consensus_key(handler, methods, mode, trim), filter_name, params, handler.get_fps())
+    group = f'{handler.get_current_video()}-'
+    return handler.get_cached_array('smoothed', f'{group}{key}.npy', lambda: smooth_track(track, filter_name, handler.get_fps(), **params), group)
+
+def get_smoothed_method(handler, method, filter_name='one_euro', **params):
+    '''
+    return the smoothed (frames, 75, 4) joints of one method of the current video, cached like get_smoothed_consensus
+    '''
+    if filter_name == 'none':
+        return handler.get_joints(method, slice(None))[0]
+    params = dict(FILTER_PARAMS[filter_name], **params)
+    key = smoothing_key([handler.get_current_video(), handler.get_method_stamp(method)], filter_name, params, handler.get_fps())
+    group = f'{handler.get_current_video()}-{method}-'
+    compute = lambda: smooth_track(handler.get_joints(method, slice(None))[0], filter_name, handler.get_fps(), **params)
+    return handler.get_cached_array('smoothed', f'{group}{key}.npy', compute, group)
@@ -0,0 +1,61 @@
+import numpy as np
+
+#colors of the strip, RGB
+LABELED_COLOR = np.array([0, 170, 255], dtype=np.float64)
+UNLABELED_COLOR = np.array([40, 40, 40], dtype=np.float64)
+GOOD_COLOR = np.array([0, 160, 60], dtype=np.float64)
+BAD_COLOR = np.array([230, 40, 30], dtype=np.float64)
+
+
+class TimelineSummary:
+    '''
+    Per frame status of a video downsampled to a fixed number of bins, so the timeline draws in constant time
+    whatever the video length: the labeled frame count and the worst review score of each bin
+    '''
+    def __init__(self, total_frames, bins=512, labeled_frames=(), scores=None):
+        '''
+        total_frames: number of frames of the video
+        bins: width of the summary, at most one bin per frame
+        labeled_frames: frames labeled so far
+        scores: optional review score of every frame (higher is worse), see review_queue.review_scores
+        '''
+        self.total_frames = max(int(total_frames), 1)
+        self.bins = max(1, min(bins, self.total_frames))
+        self.bin_size = np.bincount(self.get_bin(np.arange(self.total_frames)), minlength=self.bins)
+        self.bin_start = np.concatenate(([0], np.cumsum(self.bin_size)[:-1]))
+        self.labeled = np.bincount(self.get_bin(np.asarray(labeled_frames, dtype=np.int64)), minlength=self.bins)[:self.bins]
+        self.quality = np.zeros(self.bins, dtype=np.float64)
+        if scores is not None and len(scores) > 0:
+            scores = np.nan_to_num(np.asarray(scores[:self.total_frames], dtype=np.float64))
+            #worst frame of each bin, scaled so the 95th percentile of the video is fully red
+            starts = self.bin_start[self.bin_start < len(scores)]
+            worst = np.maximum.reduceat(scores, starts)
+            scale = np.percentile(scores, 95)
+            self.quality[:len(worst)] = np.clip(worst / scale, 0, 1) if scale > 0 else 0
+    def get_bin(self, frames):
+        return np.minimum(np.asarray(frames) * self.bins // self.total_frames, self.bins - 1)
+    def bin_range(self, frame):
+        '''
+        return the frames [start, end) of the bin of a frame
+        '''
+        i = int(self.get_bin(frame))
+        return int(self.bin_start[i]), int(self.bin_start[i] + self.bin_size[i])
+    def set_labeled_count(self, frame, count):
+        '''
+        set the labeled frame count of the bin of a frame after a change, return the bin
+        '''
+        i = int(self.get_bin(frame))
+        self.labeled[i] = count
+        return i
+    def labeled_colors(self, bins=slice(None)):
+        '''
+        return the (bins, 3) uint8 RGB colors of the labeled row: the labeled fraction of each bin
+        '''
+        fraction = np.minimum(self.labeled[bins] / self.bin_size[bins], 1)[:, None]
+        return (UNLABELED_COLOR + fraction * (LABELED_COLOR - UNLABELED_COLOR)).astype(np.uint8)
+    def quality_colors(self, bins=slice(None)):
+        '''
+        return the (bins, 3) uint8 RGB colors of the quality row, from green (methods agree) to red
+        '''
+        quality = self.quality[bins][:, None]
+        return (GOOD_COLOR + quality * (BAD_COLOR - GOOD_COLOR)).astype(np.uint8)